@@ -2,11 +2,8 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import base64
-from database import Database
-from book import Book
-from member import Member
-from transaction import Transaction
-from report import Report
+from repository import Library
+from query_cache import QueryCache
 
 # Page configuration
 st.set_page_config(
@@ -102,14 +99,14 @@ def add_bg_from_local(image_file):
 @st.cache_resource
 def get_managers():
     try:
-        db = Database()
-        db.create_tables()
+        # One Database (and connection pool) shared by every manager
+        library = Library()
+        library.db.create_tables()
         return {
-            'db': db,
-            'book': Book(),
-            'member': Member(),
-            'transaction': Transaction(),
-            'report': Report()
+            'db': library.db,
+            'cache': QueryCache(library.db),
+            'library': library,
+            **library.managers()
         }
     except Exception as e:
         st.error(f"Initialization error: {e}")
@@ -123,11 +120,26 @@ add_bg_from_local("./assets/background.png")
 if not managers:
     st.stop()
 
+# Previous / next controls for a keyset-paginated table
+def render_pager(page_data, state_key, label):
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("⬅️ Previous", key=f"{state_key}_prev", disabled=not page_data['prev_cursor']):
+            st.session_state[state_key] = page_data['prev_cursor']
+            st.rerun()
+    with col_info:
+        st.caption(f"Showing {len(page_data['rows'])} of {page_data['total']} {label}")
+    with col_next:
+        if st.button("Next ➡️", key=f"{state_key}_next", disabled=not page_data['next_cursor']):
+            st.session_state[state_key] = page_data['next_cursor']
+            st.rerun()
+
 # Helper accessors
 book_mgr = managers['book']
 member_mgr = managers['member']
 trans_mgr = managers['transaction']
 report_mgr = managers['report']
+query_cache = managers['cache']
 
 # Sidebar Navigation
 st.sidebar.markdown("# 🏛️ Athena Library")
@@ -141,7 +153,9 @@ if "Dashboard" in page:
     # Wrap dashboard stats in a container for better white-box effect if needed, 
     # but metrics have their own boxes via CSS above.
     
-    stats = report_mgr.get_library_statistics()
+    # Overdue count moves with the clock, so also expire after a minute
+    stats = query_cache.call(report_mgr.get_library_statistics,
+        tables=('books', 'members', 'transactions'), ttl=60)
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -175,10 +189,17 @@ elif "Books" in page:
     with tab1:
         st.markdown("### 📖 Browse Inventory")
         search_term = st.text_input("Find books by Title, Author, or ISBN")
+        book_page = None
         if search_term:
-            books = book_mgr.search_books(search_term)
+            books = query_cache.call(book_mgr.search_books, search_term, tables=('books',))
         else:
-            books = book_mgr.get_all_books()
+            book_page = query_cache.call(book_mgr.get_books_page,
+                cursor=st.session_state.get('books_cursor'), tables=('books',))
+            if not book_page['rows'] and st.session_state.get('books_cursor'):
+                # Stale cursor (rows deleted since): start over from page one
+                del st.session_state['books_cursor']
+                st.rerun()
+            books = book_page['rows']
             
         if books:
             df = pd.DataFrame(books, columns=[
@@ -187,6 +208,9 @@ elif "Books" in page:
             ])
             st.dataframe(df, use_container_width=True)
             
+            if book_page:
+                render_pager(book_page, 'books_cursor', 'books')
+            
             st.divider()
             with st.expander("🗑️ Delete Book"):
                 book_id_to_del = st.number_input("Enter Book ID to Remove", min_value=1, step=1)
@@ -233,10 +257,17 @@ elif "Members" in page:
     with tab1:
         st.markdown("### 🔍 Find Members")
         search_member = st.text_input("Search by Name, Email or Phone")
+        member_page = None
         if search_member:
-            members = member_mgr.search_members(search_member)
+            members = query_cache.call(member_mgr.search_members, search_member, tables=('members',))
         else:
-            members = member_mgr.get_all_members()
+            member_page = query_cache.call(member_mgr.get_members_page,
+                cursor=st.session_state.get('members_cursor'), tables=('members',))
+            if not member_page['rows'] and st.session_state.get('members_cursor'):
+                # Stale cursor (rows deleted since): start over from page one
+                del st.session_state['members_cursor']
+                st.rerun()
+            members = member_page['rows']
 
         if members:
             try:
@@ -247,6 +278,9 @@ elif "Members" in page:
             except ValueError:
                  st.dataframe(members)
             
+            if member_page:
+                render_pager(member_page, 'members_cursor', 'members')
+            
             st.divider()
             with st.expander("🗑️ Remove Member"):
                 mid_del = st.number_input("Member ID to Remove", min_value=1)
@@ -308,7 +342,7 @@ elif "Circulation" in page:
             st.subheader("1. Identify Member")
             m_search = st.text_input("Search Member", key="m_search")
             if m_search:
-                m_results = member_mgr.search_members(m_search)
+                m_results = query_cache.call(member_mgr.search_members, m_search, tables=('members',))
                 if m_results:
                     m_opts = {f"{m[1]} ({m[2]})": m[0] for m in m_results}
                     sel_m = st.selectbox("Select Member", list(m_opts.keys()), key="sel_m")
@@ -320,8 +354,7 @@ elif "Circulation" in page:
             st.subheader("2. Identify Book")
             b_search = st.text_input("Search Book", key="b_search")
             if b_search:
-                b_results = book_mgr.search_books(b_search)
-                avail_books = [b for b in b_results if b[6] > 0]
+                avail_books = book_mgr.search_available(b_search)
                 if avail_books:
                     b_opts = {f"{b[1]} - {b[2]}": b[0] for b in avail_books}
                     sel_b = st.selectbox("Select Book", list(b_opts.keys()), key="sel_b")
@@ -341,13 +374,14 @@ elif "Circulation" in page:
 
     elif "Return" in mode:
         st.markdown("### 📥 Return a Book")
-        loans = trans_mgr.get_active_transactions()
+        loans = query_cache.call(trans_mgr.get_active_transactions,
+            tables=('books', 'members', 'transactions'))
         if loans:
             loan_opts = {f"Loan #{l[0]} | {l[1]} ({l[2]}) | Due: {l[4]}": l[0] for l in loans}
             sel_loan_label = st.selectbox("Select Loan to Return", list(loan_opts.keys()))
             sel_loan_id = loan_opts[sel_loan_label]
             
-            fine = trans_mgr.calculate_fine(sel_loan_id)
+            fine = trans_mgr.calculate_fines([sel_loan_id]).get(sel_loan_id, 0.0)
             if fine > 0:
                 st.error(f"⚠️ Overdue Fine: ${fine:.2f}")
             else:
@@ -364,7 +398,8 @@ elif "Circulation" in page:
 
     elif "Active Loans" in mode:
         st.markdown("### 📋 Ongoing Transactions")
-        loans = trans_mgr.get_active_transactions()
+        loans = query_cache.call(trans_mgr.get_active_transactions,
+            tables=('books', 'members', 'transactions'))
         if loans:
             df = pd.DataFrame(loans, columns=['ID', 'Book Title', 'Borrower', 'Issued On', 'Due Date'])
             st.dataframe(df, use_container_width=True)
@@ -380,14 +415,15 @@ elif "Reports" in page:
     
     if "Popular" in r_type:
         st.subheader("🔥 Most Borrowed Books")
-        data = report_mgr.get_popular_books()
+        data = query_cache.call(report_mgr.get_popular_books, tables=('books', 'transactions'))
         if data:
             df = pd.DataFrame(data, columns=['ID', 'Title', 'Author', 'Borrows'])
             st.bar_chart(df.set_index('Title')['Borrows'])
             
     elif "Overdue" in r_type:
         st.subheader("⚠️ Overdue Items")
-        data = report_mgr.get_overdue_books()
+        data = query_cache.call(report_mgr.get_overdue_books,
+            tables=('books', 'members', 'transactions', 'settings'), ttl=60)
         if data:
             df = pd.DataFrame(data, columns=['TRX ID', 'Book', 'Member', 'Email', 'Issue Date', 'Due Date', 'Days Over', 'Fine'])
             st.dataframe(df)
@@ -396,7 +432,7 @@ elif "Reports" in page:
             
     elif "Category" in r_type:
         st.subheader("📚 Collection Distribution")
-        data = report_mgr.get_category_distribution()
+        data = query_cache.call(report_mgr.get_category_distribution, tables=('books',))
         if data:
             df = pd.DataFrame(data, columns=['Category', 'Count'])
             fig = px.pie(df, values='Count', names='Category', hole=0.4)
@@ -404,7 +440,35 @@ elif "Reports" in page:
             
     elif "Top Readers" in r_type:
         st.subheader("🏆 Most Active Members")
-        data = report_mgr.get_top_members()
+        data = query_cache.call(report_mgr.get_top_members, tables=('members', 'transactions'))
         if data:
             df = pd.DataFrame(data, columns=['ID', 'Name', 'Email', 'Borrowed Count', 'Last Active'])
             st.bar_chart(df.set_index('Name')['Borrowed Count'])
+
+# Debug panel, rendered last so the numbers include this run
+with st.sidebar.expander("🛠️ Debug"):
+    cache_stats = query_cache.stats()
+    st.caption(f"Query cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+               f"({cache_stats['hit_ratio']:.0%})")
+    st.caption(f"{cache_stats['entries']} entries, {cache_stats['bytes'] / 1024:.0f} KiB "
+               f"of {cache_stats['max_bytes'] / 1024 / 1024:.0f} MiB, "
+               f"{cache_stats['evictions']} evicted, {cache_stats['stale']} stale")
+    if st.button("Clear cache"):
+        query_cache.clear()
+    report_lag = report_mgr.staleness()
+    st.caption("Reports: live read-only snapshot" if report_lag == 0 else
+               f"Reports: in-memory copy, {report_lag:.0f}s old")
+    st.markdown("**Top queries by total time**")
+    top_queries = managers['db'].query_stats(10)
+    if top_queries:
+        st.dataframe(pd.DataFrame(top_queries)[['normalized', 'calls', 'total_ms', 'mean_ms',
+                                                'max_ms', 'rows', 'slow', 'errors']],
+                     hide_index=True)
+    slow = managers['db'].slow_queries()
+    if slow:
+        st.caption(f"{len(slow)} slow queries (≥ {managers['db'].instruments.slow_query_ms:.0f} ms); latest:")
+        st.code(f"{slow[-1]['normalized']}\n-- {slow[-1]['elapsed_ms']} ms\n" +
+                "\n".join(f"-- {step}" for step in slow[-1]['plan']), language="sql")
+    errors = managers['db'].query_errors()
+    if errors:
+        st.caption(f"{len(errors)} recent query errors; latest: {errors[-1]['error']}")
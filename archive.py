@@ -0,0 +1,225 @@
+# archive.py
+"""Cold-history archival of settled transactions.
+
+    python maintenance.py archive-transactions --older-than-days 365
+
+Loans that are long returned and have no unpaid fine move from
+``transactions`` into ``transactions`` in a sibling archive file
+(``library_archive.db`` for ``library.db``). Every connection attaches the
+archive as ``archive`` when it exists, and the temp view
+``all_transactions`` unions hot and archived rows for reports that ask for
+full history.
+
+Whole issue days are archived at a time, and only when every loan issued
+that day is settled. Such a day can never be marked dirty again, so the
+daily activity rollup never recomputes it from the (now partial) hot
+table. The popularity and activity rollups already cover archived rows,
+and settled rows don't contribute to the dashboard counters.
+
+Each chunk is copied and committed to the archive (with synchronous=FULL)
+before it is deleted from the hot table, so a crash can at worst leave a
+day in both places. ``all_transactions`` skips hot rows that are already
+archived, so such loans still count once, and every run starts by deleting
+them from the hot table. Copies use INSERT OR IGNORE, so re-running over
+the same days is harmless.
+"""
+import os
+import time
+
+from migrations import day_start_sql, local_date_sql
+
+ARCHIVE_SCHEMA = 'archive'
+DEFAULT_ARCHIVE_AGE_DAYS = 365
+DEFAULT_ARCHIVE_CHUNK = 5000
+HISTORY_COLUMNS = ('transaction_id, book_id, member_id, issue_date, due_date, '
+                   'return_date, fine_amount, fine_paid')
+
+# Issue days (local calendar) before the cutoff whose loans are all returned
+# and paid up; the cutoff is the epoch second of a local midnight
+SETTLED_DAYS_SQL = f'''
+    SELECT {local_date_sql('issue_date')} AS day, COUNT(*) AS loans
+    FROM main.transactions
+    WHERE issue_date < :cutoff
+    GROUP BY day
+    HAVING SUM(return_date IS NULL OR return_date >= :cutoff
+               OR (fine_amount > 0 AND fine_paid = FALSE)) = 0
+    ORDER BY day
+'''
+
+
+class ArchiveUnavailable(Exception):
+    """An archive file exists but can't be read on this connection"""
+
+
+def archive_path(db_name):
+    """Archive file that goes with ``db_name`` (None for in-memory databases)"""
+    if db_name == ':memory:':
+        return None
+    root, ext = os.path.splitext(db_name)
+    return f'{root}_archive{ext or ".db"}'
+
+
+def is_attached(conn):
+    return any(row[1] == ARCHIVE_SCHEMA for row in conn.execute('PRAGMA database_list'))
+
+
+def attach_archive(conn, path, create=False):
+    """Attach the archive file as ``archive``; returns whether it is attached"""
+    if not is_attached(conn):
+        if not path or (not create and not os.path.exists(path)):
+            return False
+        conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+    if create:
+        conn.execute(f'PRAGMA {ARCHIVE_SCHEMA}.journal_mode = WAL')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.transactions (
+                transaction_id INTEGER PRIMARY KEY,
+                book_id INTEGER NOT NULL,
+                member_id INTEGER NOT NULL,
+                issue_date TIMESTAMP,
+                due_date TIMESTAMP,
+                return_date TIMESTAMP,
+                fine_amount REAL DEFAULT 0.0,
+                fine_paid BOOLEAN DEFAULT FALSE,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_member_issue
+            ON transactions (member_id, issue_date)
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_book
+            ON transactions (book_id)
+        ''')
+        conn.commit()
+    return True
+
+
+def create_history_view(conn):
+    """(Re)create ``temp.all_transactions`` over hot and archived loans"""
+    archived = is_attached(conn) and conn.execute(
+        f"SELECT 1 FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE type = 'table' AND name = 'transactions'"
+    ).fetchone()
+    conn.execute('DROP VIEW IF EXISTS temp.all_transactions')
+    query = f'CREATE TEMP VIEW all_transactions AS SELECT {HISTORY_COLUMNS} FROM main.transactions h'
+    if archived:
+        # A loan copied by a run that crashed before its delete counts once
+        query += (f' WHERE NOT EXISTS (SELECT 1 FROM {ARCHIVE_SCHEMA}.transactions a'
+                  f' WHERE a.transaction_id = h.transaction_id)'
+                  f' UNION ALL SELECT {HISTORY_COLUMNS} FROM {ARCHIVE_SCHEMA}.transactions')
+    conn.execute(query)
+
+
+def history_includes_archive(conn):
+    """Check whether ``temp.all_transactions`` already unions in the archive"""
+    row = conn.execute(
+        "SELECT sql FROM sqlite_temp_master WHERE type = 'view' AND name = 'all_transactions'"
+    ).fetchone()
+    return row is not None and f'{ARCHIVE_SCHEMA}.transactions' in row[0]
+
+
+def archive_transactions(db, older_than_days=DEFAULT_ARCHIVE_AGE_DAYS,
+                         chunk_size=DEFAULT_ARCHIVE_CHUNK, pause=0.0):
+    """Move settled loans older than ``older_than_days`` into the archive.
+
+    First deletes hot rows a crashed run already copied. Then works through
+    whole issue days, about ``chunk_size`` loans per write transaction,
+    sleeping ``pause`` seconds between chunks so desk writes get the lock
+    in between. Returns counts and timing.
+    """
+    if db.archive_name is None:
+        raise ValueError('In-memory databases have no archive file')
+    # Imported here: report imports database, which imports this module
+    from report import Report
+
+    start = time.perf_counter()
+    archived = days = chunks = 0
+    # Fold pending changes into the daily rollup while the rows are still hot
+    Report(db).refresh_activity()
+    with db.get_connection() as conn:
+        attach_archive(conn, db.archive_name, create=True)
+        create_history_view(conn)
+        conn.execute(f'PRAGMA {ARCHIVE_SCHEMA}.synchronous = FULL')
+        recovered = _delete_archived(db)
+        cutoff_day = conn.execute(
+            "SELECT date('now', 'localtime', ?)", (f'-{older_than_days} days',)).fetchone()[0]
+        cutoff = conn.execute(f"SELECT {day_start_sql('?')}", (cutoff_day,)).fetchone()[0]
+        settled = conn.execute(SETTLED_DAYS_SQL, {'cutoff': cutoff}).fetchall()
+
+        batch, batch_loans = [], 0
+        for day, loans in settled + [(None, 0)]:
+            if day is not None and (not batch or batch_loans + loans <= chunk_size):
+                batch.append(day)
+                batch_loans += loans
+                continue
+            if batch:
+                archived += _archive_days(db, batch[0], batch[-1], cutoff)
+                days += len(batch)
+                chunks += 1
+                if pause:
+                    time.sleep(pause)
+            batch, batch_loans = [day], loans
+        conn.execute('PRAGMA optimize')
+
+    return {
+        'cutoff': cutoff_day,
+        'recovered_loans': recovered,
+        'archived_loans': archived,
+        'archived_days': days,
+        'chunks': chunks,
+        'elapsed_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def _delete_archived(db):
+    """Finish the delete of hot rows that are already in the archive"""
+    with db.transaction() as conn:
+        return conn.execute(f'''
+            DELETE FROM main.transactions
+            WHERE transaction_id IN (SELECT transaction_id FROM {ARCHIVE_SCHEMA}.transactions)
+        ''').rowcount
+
+
+def _archive_days(db, first_day, last_day, cutoff):
+    """Copy then delete one chunk of settled days; returns loans moved"""
+    # Days in the range were settled when listed; skip any that gained an
+    # unpaid fine since
+    in_range = f'''
+        issue_date >= {day_start_sql(':first')} AND issue_date < {day_start_sql(':last', '+1 day')}
+        AND {local_date_sql('issue_date')} NOT IN (
+            SELECT {local_date_sql('issue_date')} FROM main.transactions
+            WHERE issue_date >= {day_start_sql(':first')} AND issue_date < {day_start_sql(':last', '+1 day')}
+            AND (return_date IS NULL OR return_date >= :cutoff
+                 OR (fine_amount > 0 AND fine_paid = FALSE)))
+    '''
+    params = {'first': first_day, 'last': last_day, 'cutoff': cutoff}
+    with db.transaction() as conn:
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.transactions ({HISTORY_COLUMNS})
+            SELECT {HISTORY_COLUMNS} FROM main.transactions
+            WHERE {in_range}
+        ''', params)
+    with db.transaction() as conn:
+        return conn.execute(f'''
+            DELETE FROM main.transactions
+            WHERE {in_range}
+            AND transaction_id IN (SELECT transaction_id FROM {ARCHIVE_SCHEMA}.transactions)
+        ''', params).rowcount
+
+
+def archive_stats(db):
+    """Loan counts and date range in the hot table and the archive"""
+    with db.get_connection() as conn:
+        hot = conn.execute(
+            "SELECT COUNT(*), datetime(MIN(issue_date), 'unixepoch', 'localtime') FROM main.transactions"
+        ).fetchone()
+        stats = {'hot_loans': hot[0], 'hot_oldest_issue': hot[1],
+                 'archive_file': db.archive_name, 'archived_loans': 0, 'archive_oldest_issue': None}
+        if attach_archive(conn, db.archive_name) and conn.execute(
+                f"SELECT 1 FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE name = 'transactions'").fetchone():
+            cold = conn.execute(
+                f"SELECT COUNT(*), datetime(MIN(issue_date), 'unixepoch', 'localtime') "
+                f"FROM {ARCHIVE_SCHEMA}.transactions").fetchone()
+            stats['archived_loans'], stats['archive_oldest_issue'] = cold
+    return stats
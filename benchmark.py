@@ -0,0 +1,396 @@
+# benchmark.py
+"""Time every public manager method against a synthetic library.
+
+    python benchmark.py --books 100000 --members 20000 --transactions 1000000 \
+        --out results.json --compare baseline.json
+
+Generates (or reuses, with ``--db``) a seeded library from ``datagen``,
+runs each public method of Book, Member, Transaction and Report with
+realistic arguments and records p50/p95/p99 latency and rows/s. Results
+are written as JSON; ``--compare`` prints the p50/p95 change against an
+earlier run so a regression shows up before it ships.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager
+from datetime import datetime
+from urllib.request import pathname2url
+
+from book import Book
+from database import Database
+from datagen import FIRST_NAMES, TITLE_WORDS, generate_library
+from member import Member
+from report import Report
+from transaction import Transaction
+
+DEFAULT_ITERATIONS = 50
+# Whole-table reads; a few runs are enough to see how they scale
+FULL_SCAN_ITERATIONS = 5
+
+
+class BenchContext:
+    """Managers, sample ids and the ids created by write benchmarks"""
+
+    def __init__(self, db, seed):
+        self.rng = random.Random(seed)
+        self.book = Book(db)
+        self.member = Member(db)
+        self.transaction = Transaction(db)
+        self.report = Report(db)
+        self.book_ids = [row[0] for row in db.fetch_all('SELECT book_id FROM books')]
+        self.member_ids = [row[0] for row in db.fetch_all(
+            "SELECT member_id FROM members WHERE status = 'Active'")]
+        self.open_ids = [row[0] for row in db.fetch_all(
+            'SELECT transaction_id FROM transactions WHERE return_date IS NULL')]
+        self.fined_ids = [row[0] for row in db.fetch_all(
+            'SELECT transaction_id FROM transactions WHERE fine_amount > 0 AND fine_paid = 0 LIMIT 10000')]
+        # Activity windows end at the newest loan rather than today: generated
+        # data is dated up to datagen's fixed ``now``, so a window relative to
+        # the real clock can be empty
+        latest, self.activity_start = db.fetch_one(
+            "SELECT MAX(issue_date), date(MAX(issue_date), 'unixepoch', 'localtime', 'start of month', "
+            "'-6 months') FROM transactions")
+        self.activity_months = 6
+        if latest is not None:
+            newest, today = datetime.fromtimestamp(latest), datetime.now()
+            self.activity_months += max((today.year - newest.year) * 12 + today.month - newest.month, 0)
+        self.new_books = []
+        self.new_members = []
+        self.new_loans = []
+        self.serial = 0
+
+    def book_id(self):
+        return self.rng.choice(self.book_ids)
+
+    def member_id(self):
+        return self.rng.choice(self.member_ids)
+
+    def next_serial(self):
+        self.serial += 1
+        return self.serial
+
+    def new_book(self):
+        """A fresh benchmark-only book with a free copy"""
+        if not self.new_books:
+            n = self.next_serial()
+            self.book.add_book(f'Bench Book {n}', 'Bench Author', f'bench-{n}', 'Other', 1000)
+            self.new_books.append(self.book.db.fetch_one(
+                'SELECT book_id FROM books WHERE isbn = ?', (f'bench-{n}',))[0])
+        return self.new_books[-1]
+
+    def new_member(self):
+        if not self.new_members:
+            n = self.next_serial()
+            self.member.add_member(f'Bench Member {n}', f'bench{n}@example.org')
+            self.new_members.append(self.member.db.fetch_one(
+                'SELECT member_id FROM members WHERE email = ?', (f'bench{n}@example.org',))[0])
+        return self.new_members[-1]
+
+    def borrower(self):
+        """A member with no loans yet, so the loan limit never interferes"""
+        n = self.next_serial()
+        self.member.add_member(f'Bench Borrower {n}', f'borrower{n}@example.org')
+        return self.member.db.fetch_one(
+            'SELECT member_id FROM members WHERE email = ?', (f'borrower{n}@example.org',))[0]
+
+    def loan(self):
+        """An open loan issued by the benchmark itself"""
+        if not self.new_loans:
+            self.transaction.issue_book(self.new_book(), self.borrower())
+            self.new_loans.append(self.transaction.db.fetch_one(
+                'SELECT MAX(transaction_id) FROM transactions')[0])
+        return self.new_loans.pop()
+
+
+def _added_book(ctx):
+    n = ctx.next_serial()
+    return (f'Bench Book {n}', 'Bench Author', f'bench-{n}', 'Other', 1000)
+
+
+def _added_member(ctx):
+    n = ctx.next_serial()
+    return (f'Bench Member {n}', f'bench{n}@example.org', f'555{n:07d}')
+
+
+def _update_book(ctx):
+    book_id = ctx.new_book()
+    row = ctx.book.get_book_by_id(book_id)
+    return (book_id, row[1], row[2], row[3], row[4], row[5], row[6])
+
+
+def _update_member(ctx):
+    member_id = ctx.new_member()
+    row = ctx.member.get_member_by_id(member_id)
+    return (member_id, row[1], row[2], row[3], 'Active')
+
+
+def _issue(ctx):
+    return (ctx.new_book(), ctx.borrower())
+
+
+def _pop_new(ids):
+    return (ids.pop(),) if ids else None
+
+
+# 'manager.method' -> builds the arguments for one call, in run order. Reads
+# come first so writes don't skew them; a builder returning None skips the call.
+BENCHMARKS = {
+    'book.get_all_books': lambda ctx: (),
+    'book.get_books_page': lambda ctx: (),
+    'book.count_books': lambda ctx: (),
+    'book.get_book_by_id': lambda ctx: (ctx.book_id(),),
+    'book.search_books': lambda ctx: (ctx.rng.choice(TITLE_WORDS),),
+    'book.search_available': lambda ctx: (ctx.rng.choice(TITLE_WORDS)[:3],),
+    'book.get_available_books': lambda ctx: (),
+    'member.get_all_members': lambda ctx: (),
+    'member.get_members_page': lambda ctx: (),
+    'member.count_members': lambda ctx: (),
+    'member.get_member_by_id': lambda ctx: (ctx.member_id(),),
+    'member.search_members': lambda ctx: (ctx.rng.choice(FIRST_NAMES),),
+    'member.get_active_members': lambda ctx: (),
+    'transaction.get_active_transactions': lambda ctx: (),
+    'transaction.get_transaction_history': lambda ctx: (),
+    'transaction.get_member_transactions': lambda ctx: (ctx.member_id(),),
+    'transaction.calculate_fine': lambda ctx: (ctx.rng.choice(ctx.open_ids),) if ctx.open_ids else None,
+    'transaction.calculate_fines': lambda ctx: (),
+    'transaction.iter_transactions': lambda ctx: (),
+    'report.get_library_statistics': lambda ctx: (),
+    'report.get_overdue_count': lambda ctx: (),
+    'report.get_available_books': lambda ctx: (),
+    'report.get_popular_books': lambda ctx: (),
+    'report.get_books_by_category': lambda ctx: (),
+    'report.get_member_statistics': lambda ctx: (),
+    'report.iter_member_statistics': lambda ctx: (),
+    'report.get_overdue_books': lambda ctx: (),
+    'report.iter_overdue_books': lambda ctx: (),
+    'report.get_category_distribution': lambda ctx: (),
+    'report.get_top_members': lambda ctx: (),
+    'report.snapshot': lambda ctx: (),
+    'report.staleness': lambda ctx: (),
+    'report.get_monthly_activity': lambda ctx: (ctx.activity_months,),
+    'report.get_activity': lambda ctx: (ctx.activity_start, None, 'month'),
+    'report.refresh_activity': lambda ctx: (),
+    'report.refresh_activity_if_stale': lambda ctx: (),
+    'report.activity_pending': lambda ctx: (),
+    'report.reconcile_counters': lambda ctx: (),
+    'report.rebuild_popularity': lambda ctx: (),
+    'book.add_book': _added_book,
+    'book.update_book': _update_book,
+    'book.update_copies': lambda ctx: (ctx.new_book(), ctx.rng.choice((1, -1))),
+    'member.add_member': _added_member,
+    'member.update_member': _update_member,
+    'member.update_books_borrowed': lambda ctx: (ctx.new_member(), 0),
+    'transaction.issue_book': _issue,
+    'transaction.issue_many': lambda ctx: (ctx.borrower(), [ctx.new_book()]),
+    'transaction.return_book': lambda ctx: (ctx.loan(),),
+    'transaction.return_many': lambda ctx: ([ctx.loan()],),
+    'transaction.pay_fine': lambda ctx: (ctx.rng.choice(ctx.fined_ids), 0.0) if ctx.fined_ids else None,
+    'transaction.accrue_fines': lambda ctx: (),
+    'book.delete_book': lambda ctx: _pop_new(ctx.new_books),
+    'member.delete_member': lambda ctx: _pop_new(ctx.new_members),
+}
+
+FULL_SCANS = {
+    'book.get_all_books', 'book.get_available_books', 'member.get_all_members',
+    'member.get_active_members', 'transaction.get_active_transactions',
+    'transaction.calculate_fines', 'transaction.iter_transactions', 'transaction.accrue_fines',
+    'report.get_available_books', 'report.get_member_statistics', 'report.iter_member_statistics',
+    'report.get_overdue_books', 'report.iter_overdue_books', 'report.reconcile_counters',
+    'report.rebuild_popularity',
+}
+
+MANAGERS = {'book': Book, 'member': Member, 'transaction': Transaction, 'report': Report}
+
+
+def public_methods():
+    """Every public method name of the four managers, as 'manager.method'"""
+    return [f'{name}.{method}' for name, cls in MANAGERS.items()
+            for method, _ in inspect.getmembers(cls, inspect.isfunction)
+            if not method.startswith('_')]
+
+
+def consume(result):
+    """Drain streamed chunks and enter context managers, so their work is timed"""
+    if isinstance(result, Iterator):
+        return [row for chunk in result for row in chunk]
+    if isinstance(result, AbstractContextManager):
+        with result:
+            return None
+    return result
+
+
+def row_count(result):
+    if isinstance(result, dict):
+        return len(result['rows']) if 'rows' in result else len(result)
+    if isinstance(result, list):
+        return len(result)
+    return 1 if result is not None else 0
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _post_call(ctx, op, args, result):
+    """Keep write benchmarks supplied with fresh ids"""
+    if op == 'book.add_book' and result:
+        ctx.new_books.append(ctx.book.db.fetch_one(
+            'SELECT book_id FROM books WHERE isbn = ?', (args[2],))[0])
+    elif op == 'member.add_member' and result:
+        ctx.new_members.append(ctx.member.db.fetch_one(
+            'SELECT member_id FROM members WHERE email = ?', (args[1],))[0])
+    elif op in ('transaction.issue_book', 'transaction.issue_many') and result:
+        if op == 'transaction.issue_many':
+            ctx.new_loans.extend(item['transaction_id'] for item in result if item['success'])
+        else:
+            ctx.new_loans.append(ctx.transaction.db.fetch_one(
+                'SELECT MAX(transaction_id) FROM transactions')[0])
+
+
+def run_benchmarks(db, iterations=DEFAULT_ITERATIONS, seed=42, only=None):
+    ctx = BenchContext(db, seed)
+    try:
+        results = _run(ctx, iterations, only)
+    finally:
+        if ctx.report.reader is not db:
+            ctx.report.reader.close()
+    for op in public_methods():
+        if op not in BENCHMARKS:
+            results[op] = {'skipped': 'no benchmark defined'}
+    return results
+
+
+def _run(ctx, iterations, only):
+    results = {}
+    for op, build in BENCHMARKS.items():
+        if only and op not in only:
+            continue
+        manager_name, _, method = op.partition('.')
+        func = getattr(getattr(ctx, manager_name), method)
+        runs = min(iterations, FULL_SCAN_ITERATIONS) if op in FULL_SCANS else iterations
+        timings, rows = [], 0
+        for _ in range(runs):
+            args = build(ctx)
+            if args is None:
+                break
+            start = time.perf_counter()
+            result = consume(func(*args))
+            timings.append((time.perf_counter() - start) * 1000)
+            rows += row_count(result)
+            _post_call(ctx, op, args, result)
+        if not timings:
+            results[op] = {'skipped': 'no suitable rows'}
+            continue
+        total_ms = sum(timings)
+        timings.sort()
+        results[op] = {
+            'calls': len(timings),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'max_ms': round(timings[-1], 3),
+            'rows_per_call': round(rows / len(timings), 1),
+            'rows_per_second': round(rows / (total_ms / 1000), 1) if total_ms else 0.0,
+        }
+    return results
+
+
+def compare(results, baseline):
+    """Print p50/p95 change per method against an earlier results file"""
+    previous = baseline.get('results', {})
+    print(f"{'method':<40} {'p50 ms':>10} {'Δp50':>8} {'p95 ms':>10} {'Δp95':>8}")
+    for op, current in results.items():
+        before = previous.get(op)
+        if 'p50_ms' not in current:
+            continue
+        line = f"{op:<40} {current['p50_ms']:>10.3f}"
+        if before and 'p50_ms' in before:
+            for key in ('p50_ms', 'p95_ms'):
+                change = (current[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+                if key == 'p95_ms':
+                    line += f" {current[key]:>10.3f}"
+                line += f" {change:>+7.1f}%"
+        else:
+            line += f" {'new':>8} {current['p95_ms']:>10.3f}"
+        print(line)
+
+
+def copy_database(source, target):
+    """Copy ``source`` to ``target`` with the backup API.
+
+    A plain file copy of a WAL database misses pages still in ``-wal``.
+    """
+    uri = f'file:{pathname2url(os.path.abspath(source))}?mode=ro'
+    src = sqlite3.connect(uri, uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every manager method')
+    parser.add_argument('--db', help='existing database to benchmark (a copy is used)')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--only', nargs='*', help="restrict to these 'manager.method' names")
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        if args.db:
+            # Write benchmarks mutate the data, so never touch the original
+            copy_database(args.db, db_name)
+            dataset = {'source': os.path.abspath(args.db)}
+        else:
+            dataset = generate_library(db_name, args.books, args.members, args.transactions, args.seed)
+        db = Database(db_name)
+        db.create_tables()
+        started = datetime.now()
+        results = run_benchmarks(db, args.iterations, args.seed, set(args.only or ()))
+        db.close()
+
+    output = {
+        'meta': {
+            'started': started.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'dataset': dataset,
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    else:
+        print(json.dumps(output, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# benchmark_fines.py
+"""Compare per-row Transaction.calculate_fine with batched calculate_fines.
+
+    python benchmark_fines.py --loans 100000
+
+Builds a throwaway database with the requested number of open loans
+(a mix of on-time, within-grace and capped overdue loans), checks that
+both paths agree, and prints the timings.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import Database
+from transaction import Transaction
+
+
+def build_loans(db, loans, seed=42):
+    """Create the schema and ``loans`` open transactions"""
+    db.create_tables()
+    rng = random.Random(seed)
+    now = datetime.now()
+    rows = []
+    for _ in range(loans):
+        issue_date = now - timedelta(days=rng.randint(0, 60), seconds=rng.randint(0, 86399))
+        rows.append((1, 1, issue_date, issue_date + timedelta(days=14)))
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO books (title, author, isbn, category, total_copies, available_copies) "
+                     "VALUES ('Bench', 'Bench', 'bench-isbn', 'Other', ?, 0)", (loans,))
+        conn.execute("INSERT INTO members (name, email) VALUES ('Bench', 'bench@example.com')")
+        conn.executemany('INSERT INTO transactions (book_id, member_id, issue_date, due_date) '
+                         'VALUES (?, ?, ?, ?)', rows)
+
+
+def run(loans):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'library.db'))
+        try:
+            build_loans(db, loans)
+            _run(Transaction(db))
+        finally:
+            db.close()
+
+
+def _run(trans):
+    ids = [row[0] for row in trans.db.fetch_all(
+        'SELECT transaction_id FROM transactions WHERE return_date IS NULL')]
+
+    start = time.perf_counter()
+    per_row = {tid: trans.calculate_fine(tid) for tid in ids}
+    per_row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = trans.calculate_fines()
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    trans.calculate_fines(ids)
+    batch_ids_time = time.perf_counter() - start
+
+    # A loan can cross a whole-day boundary while the per-row loop runs, so
+    # re-check disagreements against a fresh per-row value
+    mismatches = sum(1 for tid in ids if abs(per_row[tid] - batch[tid]) > 1e-9
+                     and abs(trans.calculate_fine(tid) - trans.calculate_fines([tid])[tid]) > 1e-9)
+    print(f"open loans:              {len(ids)}")
+    print(f"calculate_fine per row:  {per_row_time:.3f}s")
+    print(f"calculate_fines (all):   {batch_time:.3f}s ({per_row_time / batch_time:.0f}x)")
+    print(f"calculate_fines (ids):   {batch_ids_time:.3f}s ({per_row_time / batch_ids_time:.0f}x)")
+    print(f"mismatches:              {mismatches}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--loans', type=int, default=100000)
+    run(parser.parse_args().loans)
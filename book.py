@@ -1,11 +1,26 @@
 # book.py
+import re
+import sqlite3
+from catalog_index import DEFAULT_LIMIT, get_catalog_index
 from database import Database
+from instrumentation import logger
+from pagination import DEFAULT_PAGE_SIZE, keyset_page
 from datetime import datetime
 
+# 搜索结果默认上限
+SEARCH_LIMIT = 100
+# 支持按列限定的全文检索字段
+FTS_COLUMNS = ('title', 'author', 'category')
+# 像 ISBN（或其前缀）的搜索词：数字、连字符、空格，可带校验位 X
+ISBN_TERM = re.compile(r'[\d\s-]*\d[\d\s-]*[xX]?')
+
 class Book:
-    def __init__(self):
-        self.db = Database()
-        self.db.get_connection()
+    def __init__(self, db=None):
+        self.db = db or Database()
+        self.db.get_pool()
+        self._fts_enabled = None
+        # 流通台输入联想用的内存目录索引（首次搜索时加载）
+        self.catalog = get_catalog_index(self.db)
     
     def add_book(self, title, author, isbn, category, total_copies, publication_year=None):
         """添加新书"""
@@ -14,11 +29,16 @@ class Book:
             VALUES (?, ?, ?, ?, ?, ?, ?)
         '''
         try:
-            success = self.db.execute_query(query, 
-                (title, author, isbn, category, total_copies, total_copies, publication_year))
-            return success
-        except Exception as e:
-            print(f"Error adding book: {e}")
+            with self.catalog.transaction(self.db) as (conn, changes):
+                book_id = conn.execute(query,
+                    (title, author, isbn, category, total_copies, total_copies, publication_year)).lastrowid
+                changes.upsert(book_id, title, author, total_copies)
+            return True
+        except sqlite3.Error:
+            # 语句错误已记录到 query_errors() 和 library.db 日志
+            return False
+        except Exception:
+            logger.exception('Error adding book')
             return False
     
     def get_all_books(self):
@@ -30,6 +50,20 @@ class Book:
         '''
         return self.db.fetch_all(query)
     
+    def get_books_page(self, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """分页获取书籍（按 title, book_id 键集分页）"""
+        page = keyset_page(
+            self.db,
+            'book_id, title, author, isbn, category, total_copies, available_copies, publication_year',
+            'books', ('title', 'book_id'), (1, 0), page_size, cursor)
+        page['total'] = self.count_books()
+        return page
+    
+    def count_books(self):
+        """获取书籍总数（读取计数器表）"""
+        row = self.db.fetch_one('SELECT total_books FROM library_counters WHERE id = 1')
+        return row[0] if row else self.db.fetch_one('SELECT COUNT(*) FROM books')[0]
+    
     def get_book_by_id(self, book_id):
         """根据ID获取书籍"""
         query = '''
@@ -39,55 +73,104 @@ class Book:
         '''
         return self.db.fetch_one(query, (book_id,))
     
-    def search_books(self, search_term, search_type='all'):
+    def search_books(self, search_term, search_type='all', limit=SEARCH_LIMIT):
         """搜索书籍"""
         if not search_term:
             return self.get_all_books()
         
-        search_term = f"%{search_term}%"
-        
-        if search_type == 'title':
+        # ISBN 按前缀走 isbn 唯一索引
+        if search_type == 'isbn':
             query = '''
-                SELECT book_id, title, author, isbn, category, total_copies, available_copies
+                SELECT book_id, title, author, isbn, category, total_copies, available_copies, publication_year
                 FROM books
-                WHERE title LIKE ?
-                ORDER BY title
+                WHERE isbn >= ? AND isbn < ?
+                ORDER BY isbn
+                LIMIT ?
             '''
+            term = search_term.strip()
+            return self.db.fetch_all(query, (term, term + '\uffff', limit))
+        
+        match = self._fts_match(search_term, search_type)
+        if match and self._has_fts():
+            return self._search_fts(match, limit)
+        return self._search_like(search_term, search_type, limit)
+    
+    def search_available(self, search_term, limit=DEFAULT_LIMIT):
+        """按书名/作者词前缀（或 ISBN 前缀）搜索可借书籍，返回 (book_id, title, author, available_copies)"""
+        results = self.catalog.search(search_term, limit)
+        if not search_term or not ISBN_TERM.fullmatch(search_term.strip()):
+            return results
+        
+        # 内存索引不含 ISBN，像 ISBN 的搜索词再走 isbn_norm 索引，与书名/作者命中合并
+        term = search_term.replace('-', '').replace(' ', '').upper()
+        query = '''
+            SELECT book_id, title, author, available_copies
+            FROM books
+            WHERE isbn_norm >= ? AND isbn_norm < ? AND available_copies > 0
+            ORDER BY isbn_norm
+            LIMIT ?
+        '''
+        matches = {row[0]: tuple(row) for row in self.db.fetch_all(query, (term, term + '\uffff', limit))}
+        matches.update((row[0], row) for row in results)
+        return sorted(matches.values(), key=lambda row: (row[1], row[0]))[:limit]
+    
+    def _has_fts(self):
+        """检查全文索引是否可用"""
+        if self._fts_enabled is None:
+            row = self.db.fetch_one(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+            self._fts_enabled = row is not None
+        return self._fts_enabled
+    
+    @staticmethod
+    def _fts_match(search_term, search_type):
+        """把搜索词转换为 FTS5 前缀查询"""
+        tokens = re.findall(r'\w+', search_term)
+        if not tokens:
+            return None
+        terms = ' '.join(f'"{token}"*' for token in tokens)
+        if search_type in FTS_COLUMNS:
+            return f'{{{search_type}}} : ({terms})'
+        return terms
+    
+    def _search_fts(self, match, limit):
+        """全文检索，按 bm25 相关度排序"""
+        query = '''
+            SELECT b.book_id, b.title, b.author, b.isbn, b.category,
+                   b.total_copies, b.available_copies, b.publication_year
+            FROM books_fts
+            JOIN books b ON b.book_id = books_fts.rowid
+            WHERE books_fts MATCH ?
+            ORDER BY bm25(books_fts, 10.0, 5.0, 1.0, 2.0), b.title
+            LIMIT ?
+        '''
+        return self.db.fetch_all(query, (match, limit))
+    
+    def _search_like(self, search_term, search_type, limit):
+        """没有 FTS5 时的 LIKE 模糊搜索"""
+        search_term = f"%{search_term}%"
+        
+        if search_type == 'title':
+            where, order = 'title LIKE ?', 'title'
             params = (search_term,)
         elif search_type == 'author':
-            query = '''
-                SELECT book_id, title, author, isbn, category, total_copies, available_copies
-                FROM books
-                WHERE author LIKE ?
-                ORDER BY author, title
-            '''
-            params = (search_term,)
-        elif search_type == 'isbn':
-            query = '''
-                SELECT book_id, title, author, isbn, category, total_copies, available_copies
-                FROM books
-                WHERE isbn LIKE ?
-                ORDER BY title
-            '''
+            where, order = 'author LIKE ?', 'author, title'
             params = (search_term,)
         elif search_type == 'category':
-            query = '''
-                SELECT book_id, title, author, isbn, category, total_copies, available_copies
-                FROM books
-                WHERE category LIKE ?
-                ORDER BY category, title
-            '''
+            where, order = 'category LIKE ?', 'category, title'
             params = (search_term,)
         else:  # all
-            query = '''
-                SELECT book_id, title, author, isbn, category, total_copies, available_copies
-                FROM books
-                WHERE title LIKE ? OR author LIKE ? OR isbn LIKE ? OR category LIKE ?
-                ORDER BY title
-            '''
+            where, order = 'title LIKE ? OR author LIKE ? OR isbn LIKE ? OR category LIKE ?', 'title'
             params = (search_term, search_term, search_term, search_term)
         
-        return self.db.fetch_all(query, params)
+        query = f'''
+            SELECT book_id, title, author, isbn, category, total_copies, available_copies, publication_year
+            FROM books
+            WHERE {where}
+            ORDER BY {order}
+            LIMIT ?
+        '''
+        return self.db.fetch_all(query, params + (limit,))
     
     def update_book(self, book_id, title, author, isbn, category, total_copies, available_copies):
         """更新书籍信息"""
@@ -97,8 +180,17 @@ class Book:
                 total_copies = ?, available_copies = ?
             WHERE book_id = ?
         '''
-        return self.db.execute_query(query, 
-            (title, author, isbn, category, total_copies, available_copies, book_id))
+        try:
+            with self.catalog.transaction(self.db) as (conn, changes):
+                if conn.execute(query, (title, author, isbn, category,
+                                        total_copies, available_copies, book_id)).rowcount:
+                    changes.upsert(book_id, title, author, available_copies)
+            return True
+        except sqlite3.Error:
+            return False
+        except Exception:
+            logger.exception('Error updating book')
+            return False
     
     def delete_book(self, book_id):
         """删除书籍"""
@@ -113,7 +205,16 @@ class Book:
             return False  # 有未归还的书籍，不能删除
         
         query = 'DELETE FROM books WHERE book_id = ?'
-        return self.db.execute_query(query, (book_id,))
+        try:
+            with self.catalog.transaction(self.db) as (conn, changes):
+                conn.execute(query, (book_id,))
+                changes.remove(book_id)
+            return True
+        except sqlite3.Error:
+            return False
+        except Exception:
+            logger.exception('Error deleting book')
+            return False
     
     def get_available_books(self):
         """获取可借阅的书籍"""
@@ -132,4 +233,13 @@ class Book:
             SET available_copies = available_copies + ?
             WHERE book_id = ?
         '''
-        return self.db.execute_query(query, (change, book_id))
\ No newline at end of file
+        try:
+            with self.catalog.transaction(self.db) as (conn, changes):
+                if conn.execute(query, (change, book_id)).rowcount:
+                    changes.adjust(book_id, change)
+            return True
+        except sqlite3.Error:
+            return False
+        except Exception:
+            logger.exception('Error updating copies')
+            return False
\ No newline at end of file
@@ -0,0 +1,385 @@
+# bulk_import.py
+"""Streaming bulk import of catalog and member records.
+
+    python bulk_import.py books vendor_feed.csv
+    python bulk_import.py books vendor_feed.jsonl --chunk-size 10000
+    python bulk_import.py members semester_intake.csv
+
+Records are read one at a time from CSV or JSON Lines, validated, grouped
+into chunks and written with ``executemany`` in one transaction per chunk
+using the ``bulk-load`` pragma profile. ISBNs already in the catalog (or
+repeated in the feed) merge their copies into the existing book; members
+are matched on normalized email and either updated or reported as conflicts.
+"""
+import argparse
+import csv
+import json
+import re
+import sys
+import time
+
+from database import Database
+
+DEFAULT_CHUNK_SIZE = 5000
+# Keep at most this many reject details in memory; the count is always exact
+MAX_REJECTS_KEPT = 1000
+
+# Accepted input column names for each book field
+BOOK_FIELDS = {
+    'title': ('title',),
+    'author': ('author',),
+    'isbn': ('isbn', 'isbn13', 'isbn10'),
+    'category': ('category', 'genre'),
+    'copies': ('copies', 'total_copies', 'quantity'),
+    'publication_year': ('publication_year', 'year'),
+}
+
+# Accepted input column names for each member field
+MEMBER_FIELDS = {
+    'name': ('name', 'full_name'),
+    'email': ('email', 'email_address'),
+    'phone': ('phone', 'phone_number', 'mobile'),
+    'membership_type': ('membership_type', 'type', 'tier'),
+}
+MEMBERSHIP_TYPES = ('Regular', 'Premium', 'Student')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+$')
+
+
+class ImportReport:
+    """Counters and rejects collected while importing"""
+
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.merged = 0
+        self.updated = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.rejects = []
+        self.conflicted = 0
+        self.conflicts = []
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, line, reason, record=None):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REJECTS_KEPT:
+            self.rejects.append({'line': line, 'reason': reason, 'record': record})
+
+    def conflict(self, line, reason, record=None):
+        self.conflicted += 1
+        if len(self.conflicts) < MAX_REJECTS_KEPT:
+            self.conflicts.append({'line': line, 'reason': reason, 'record': record})
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'read': self.read,
+            'inserted': self.inserted,
+            'merged': self.merged,
+            'updated': self.updated,
+            'duplicates': self.duplicates,
+            'conflicted': self.conflicted,
+            'rejected': self.rejected,
+            'chunks': self.chunks,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'rejects': self.rejects,
+            'conflicts': self.conflicts,
+        }
+
+
+def detect_format(path):
+    """Guess the input format from the file extension"""
+    lowered = path.lower()
+    if lowered.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_records(source, fmt=None):
+    """Yield ``(line_number, record_dict)`` from a CSV or JSON Lines source.
+
+    ``source`` is a path, ``'-'`` for stdin, or an open text file.
+    """
+    if isinstance(source, str):
+        fmt = fmt or detect_format(source)
+        if source == '-':
+            yield from _read_stream(sys.stdin, fmt)
+            return
+        with open(source, newline='', encoding='utf-8-sig') as handle:
+            yield from _read_stream(handle, fmt)
+    else:
+        yield from _read_stream(source, fmt or 'csv')
+
+
+def _read_stream(handle, fmt):
+    if fmt == 'jsonl':
+        for number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, ValueError(f'Invalid JSON: {e}')
+                continue
+            yield number, record if isinstance(record, dict) else ValueError('Not a JSON object')
+    elif fmt == 'csv':
+        reader = csv.DictReader(handle)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        raise ValueError(f"Unsupported format '{fmt}' (use csv or jsonl)")
+
+
+def pick(record, names):
+    """Return the first non-empty value among ``names``"""
+    for name in names:
+        value = record.get(name)
+        if value is not None and str(value).strip() != '':
+            return str(value).strip()
+    return None
+
+
+def normalize_isbn(isbn):
+    """Strip separators and upper-case the check digit"""
+    return isbn.replace('-', '').replace(' ', '').upper()
+
+
+def isbn_is_valid(isbn):
+    """Check an already-normalized ISBN-10 or ISBN-13 checksum"""
+    if len(isbn) == 13 and isbn.isdigit():
+        total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(isbn))
+        return total % 10 == 0
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        total = sum((10 - i) * (10 if d == 'X' else int(d)) for i, d in enumerate(isbn))
+        return total % 11 == 0
+    return False
+
+
+def parse_book(record, check_isbn=True):
+    """Validate one input record; return a book tuple or raise ValueError"""
+    values = {field: pick(record, names) for field, names in BOOK_FIELDS.items()}
+    for field in ('title', 'author', 'isbn', 'category'):
+        if not values[field]:
+            raise ValueError(f'Missing {field}')
+    isbn = normalize_isbn(values['isbn'])
+    if check_isbn and not isbn_is_valid(isbn):
+        raise ValueError(f"Invalid ISBN '{values['isbn']}'")
+    try:
+        copies = int(values['copies']) if values['copies'] else 1
+        year = int(values['publication_year']) if values['publication_year'] else None
+    except ValueError as e:
+        raise ValueError(f'Invalid number: {e}')
+    if copies < 1:
+        raise ValueError('Copies must be at least 1')
+    return isbn, values['title'], values['author'], values['category'], copies, year
+
+
+def import_books(source, db_name='library.db', fmt=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 check_isbn=True):
+    """Stream books from ``source`` into the catalog and return an ImportReport"""
+    db = Database(db_name, pool_size=1, profile='bulk-load')
+    db.create_tables()
+    report = ImportReport()
+    chunk = {}
+    try:
+        for line, record in read_records(source, fmt):
+            report.read += 1
+            if isinstance(record, Exception):
+                report.reject(line, str(record))
+                continue
+            try:
+                book = parse_book(record, check_isbn)
+            except ValueError as e:
+                report.reject(line, str(e), record)
+                continue
+            pending = chunk.get(book[0])
+            if pending:
+                # Same ISBN again in the feed: just add its copies
+                pending[4] += book[4]
+                report.duplicates += 1
+            else:
+                chunk[book[0]] = list(book)
+            if len(chunk) >= chunk_size:
+                _write_books_chunk(db, chunk, report)
+                chunk = {}
+        if chunk:
+            _write_books_chunk(db, chunk, report)
+    finally:
+        db.close()
+    return report.finish()
+
+
+def _write_books_chunk(db, chunk, report):
+    """Merge one chunk of books in a single transaction"""
+    with db.transaction() as conn:
+        isbns = list(chunk)
+        existing = {}
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(isbns), 500):
+            part = isbns[i:i + 500]
+            rows = conn.execute(f'''
+                SELECT isbn_norm, MIN(book_id) FROM books
+                WHERE isbn_norm IN ({', '.join('?' * len(part))})
+                GROUP BY isbn_norm
+            ''', part).fetchall()
+            existing.update(rows)
+
+        conn.executemany('''
+            UPDATE books
+            SET total_copies = total_copies + ?, available_copies = available_copies + ?
+            WHERE book_id = ?
+        ''', [(chunk[isbn][4], chunk[isbn][4], book_id) for isbn, book_id in existing.items()])
+        conn.executemany('''
+            INSERT INTO books (isbn, title, author, category, total_copies, available_copies, publication_year)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(isbn, title, author, category, copies, copies, year)
+              for isbn, title, author, category, copies, year in chunk.values()
+              if isbn not in existing])
+    report.merged += len(existing)
+    report.inserted += len(chunk) - len(existing)
+    report.chunks += 1
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def parse_member(record):
+    """Validate one input record; return a member tuple or raise ValueError.
+
+    Phone and membership type are None when the feed leaves them out, so an
+    update keeps the member's current values.
+    """
+    values = {field: pick(record, names) for field, names in MEMBER_FIELDS.items()}
+    if not values['name']:
+        raise ValueError('Missing name')
+    if not values['email']:
+        raise ValueError('Missing email')
+    email = normalize_email(values['email'])
+    if not EMAIL_PATTERN.match(email):
+        raise ValueError(f"Invalid email '{values['email']}'")
+    membership_type = values['membership_type'] and values['membership_type'].title()
+    if membership_type is not None and membership_type not in MEMBERSHIP_TYPES:
+        raise ValueError(f"Unknown membership type '{values['membership_type']}'")
+    # Stored as given; the phone_norm column holds the digits used for matching
+    return email, values['name'], values['phone'], membership_type
+
+
+def import_members(source, db_name='library.db', fmt=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                   update_existing=True):
+    """Stream members from ``source`` and return an ImportReport.
+
+    Emails are the identity: a repeat within the feed is a conflict, and an
+    email already registered either updates that member or, with
+    ``update_existing=False``, is reported as a conflict.
+    """
+    db = Database(db_name, pool_size=1, profile='bulk-load')
+    db.create_tables()
+    report = ImportReport()
+    seen = set()
+    chunk = []
+    try:
+        for line, record in read_records(source, fmt):
+            report.read += 1
+            if isinstance(record, Exception):
+                report.reject(line, str(record))
+                continue
+            try:
+                member = parse_member(record)
+            except ValueError as e:
+                report.reject(line, str(e), record)
+                continue
+            if member[0] in seen:
+                report.duplicates += 1
+                report.conflict(line, f"Duplicate email '{member[0]}' in batch", record)
+                continue
+            seen.add(member[0])
+            chunk.append((line, record, member))
+            if len(chunk) >= chunk_size:
+                _write_members_chunk(db, chunk, report, update_existing)
+                chunk = []
+        if chunk:
+            _write_members_chunk(db, chunk, report, update_existing)
+    finally:
+        db.close()
+    return report.finish()
+
+
+def _write_members_chunk(db, chunk, report, update_existing):
+    """Classify one chunk against the table in a single pass and write it"""
+    with db.transaction() as conn:
+        emails = [member[0] for _, _, member in chunk]
+        existing = {}
+        for i in range(0, len(emails), 500):
+            part = emails[i:i + 500]
+            rows = conn.execute(f'''
+                SELECT email_norm, member_id FROM members
+                WHERE email_norm IN ({', '.join('?' * len(part))})
+            ''', part).fetchall()
+            existing.update(rows)
+
+        inserts, updates = [], []
+        for line, record, (email, name, phone, membership_type) in chunk:
+            member_id = existing.get(email)
+            if member_id is None:
+                inserts.append((name, email, phone, membership_type or 'Regular'))
+            elif update_existing:
+                updates.append((name, phone, membership_type, member_id))
+            else:
+                report.conflict(line, f"Email '{email}' already registered (member {member_id})", record)
+
+        conn.executemany('''
+            UPDATE members
+            SET name = ?, phone = COALESCE(?, phone), membership_type = COALESCE(?, membership_type)
+            WHERE member_id = ?
+        ''', updates)
+        conn.executemany('''
+            INSERT INTO members (name, email, phone, membership_type)
+            VALUES (?, ?, ?, ?)
+        ''', inserts)
+    report.inserted += len(inserts)
+    report.updated += len(updates)
+    report.chunks += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import library records')
+    parser.add_argument('--db', default='library.db', help='database file (default: library.db)')
+    sub = parser.add_subparsers(dest='kind', required=True)
+
+    books = sub.add_parser('books', help='import catalog records')
+    books.add_argument('source', help="CSV or JSON Lines file, or '-' for stdin")
+    books.add_argument('--format', choices=('csv', 'jsonl'), help='input format (default: by extension)')
+    books.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    books.add_argument('--no-isbn-check', action='store_true', help='skip ISBN checksum validation')
+
+    members = sub.add_parser('members', help='import member registrations')
+    members.add_argument('source', help="CSV or JSON Lines file, or '-' for stdin")
+    members.add_argument('--format', choices=('csv', 'jsonl'), help='input format (default: by extension)')
+    members.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    members.add_argument('--no-update', action='store_true',
+                         help='report already-registered emails as conflicts instead of updating')
+
+    args = parser.parse_args(argv)
+    if args.kind == 'books':
+        report = import_books(args.source, args.db, args.format, args.chunk_size,
+                              check_isbn=not args.no_isbn_check)
+    else:
+        report = import_members(args.source, args.db, args.format, args.chunk_size,
+                                update_existing=not args.no_update)
+    print(json.dumps(report.as_dict(), indent=2, default=str))
+    return 0 if report.rejected == 0 and report.conflicted == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
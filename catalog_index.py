@@ -0,0 +1,324 @@
+# catalog_index.py
+"""In-process catalog index for typeahead search of available books.
+
+The ``books`` table is loaded once, on the first search, in title order
+into flat arrays: book id, available copies, and title/author strings.
+Every normalized title/author word maps to the (ascending, so title-ordered)
+positions of the books containing it, stored back to back in one array,
+and every one- and two-letter word prefix has its own merged position
+list. "Available books with a word starting with X" walks those lists in
+title order and stops after ``limit`` hits, with no SQL.
+
+Writes made through ``Book`` and ``Transaction`` record their changes
+(copies issued or returned, books added, edited or deleted) and apply them
+to the index after commit. The index remembers the ``books`` version from
+``table_versions`` and checks it at most every ``check_interval`` seconds,
+so writes from other processes (bulk imports, maintenance, another server)
+trigger a full reload instead of a stale answer.
+"""
+import bisect
+import heapq
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from contextlib import contextmanager
+
+DEFAULT_CHECK_INTERVAL = 1.0
+DEFAULT_LIMIT = 20
+# Prefixes up to this length get a precomputed position list
+SHORT_PREFIX = 2
+# Books added or retitled since the load sit in an unordered tail; reload
+# (which also compacts deleted positions) once it or the dead share grows
+MAX_TAIL = 1000
+MAX_DEAD_FRACTION = 0.25
+
+_WORD = re.compile(r'\w+')
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+_BOOKS_VERSION_SQL = "SELECT version FROM table_versions WHERE table_name = 'books'"
+
+
+def tokenize(text):
+    """Casefolded, accent-stripped words of ``text``"""
+    if not text:
+        return []
+    if text.isascii():
+        return _WORD.findall(text.lower())
+    text = unicodedata.normalize('NFKD', text).casefold()
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _WORD.findall(text)
+
+
+class CatalogChanges:
+    """Catalog edits made inside one write transaction"""
+    __slots__ = ('before', 'after', 'ops')
+
+    def __init__(self):
+        self.before = None
+        self.after = None
+        self.ops = []
+
+    def adjust(self, book_id, change):
+        """Available copies of ``book_id`` changed by ``change``"""
+        self.ops.append(('adjust', book_id, change))
+
+    def upsert(self, book_id, title, author, available_copies):
+        self.ops.append(('upsert', book_id, (title, author, available_copies)))
+
+    def remove(self, book_id):
+        self.ops.append(('remove', book_id, None))
+
+
+class CatalogIndex:
+    def __init__(self, db, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.db = db
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0.0
+        self.loads = 0
+        self._reset()
+
+    def _reset(self):
+        # Parallel per-position columns; a deleted book keeps its position
+        # with id 0 until the next reload
+        self._ids = array('q')
+        self._available = array('i')
+        self._titles = []
+        self._authors = []
+        self._positions = {}
+        # Loaded books: sorted distinct words, where each word's positions
+        # start in _postings, and merged positions per short prefix
+        self._base = 0
+        self._words = []
+        self._offsets = array('i', [0])
+        self._postings = array('i')
+        self._short = {}
+        # Books appended since the load: word -> positions
+        self._tail_words = []
+        self._tail = {}
+        self._dead = 0
+
+    def _load(self):
+        # Version and rows from one snapshot, so no write slips in between
+        with self.db.snapshot() as conn:
+            version = conn.execute(_BOOKS_VERSION_SQL).fetchone()
+            rows = conn.execute(
+                'SELECT book_id, title, author, available_copies FROM books ORDER BY title, book_id'
+            ).fetchall()
+        self._reset()
+        self._ids = array('q', (row[0] for row in rows))
+        self._available = array('i', (row[3] or 0 for row in rows))
+        self._titles = [row[1] or '' for row in rows]
+        self._authors = [row[2] or '' for row in rows]
+        self._positions = {book_id: position for position, book_id in enumerate(self._ids)}
+        postings = {}
+        for position, (_, title, author, _) in enumerate(rows):
+            for word in set(tokenize(title) + tokenize(author)):
+                postings.setdefault(word, []).append(position)
+        self._words = sorted(postings)
+        short = {}
+        for word in self._words:
+            self._postings.extend(postings[word])
+            self._offsets.append(len(self._postings))
+            for n in range(1, SHORT_PREFIX + 1):
+                short.setdefault(word[:n], []).append(postings[word])
+        for prefix, lists in short.items():
+            merged = lists[0] if len(lists) == 1 else sorted(set(itertools.chain.from_iterable(lists)))
+            self._short[prefix] = array('i', merged)
+        self._base = len(rows)
+        self._version = version[0] if version else None
+        self._checked_at = time.monotonic()
+        self._loaded = True
+        self.loads += 1
+
+    def _append(self, book_id, title, author, available):
+        position = len(self._ids)
+        self._ids.append(book_id)
+        self._available.append(available or 0)
+        self._titles.append(title or '')
+        self._authors.append(author or '')
+        self._positions[book_id] = position
+        for word in set(tokenize(title) + tokenize(author)):
+            if word not in self._tail:
+                self._tail[word] = []
+                bisect.insort(self._tail_words, word)
+            self._tail[word].append(position)
+
+    def _drop(self, book_id):
+        position = self._positions.pop(book_id, None)
+        if position is None:
+            return
+        # Word lists still point here; searches skip id 0
+        self._ids[position] = 0
+        self._available[position] = 0
+        self._titles[position] = self._authors[position] = ''
+        self._dead += 1
+
+    def _ensure_fresh(self):
+        if not self._loaded:
+            self._load()
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        row = self.db.fetch_one(_BOOKS_VERSION_SQL)
+        if (row[0] if row else None) != self._version:
+            self._load()
+
+    @contextmanager
+    def transaction(self, db):
+        """``db.transaction()`` whose recorded catalog changes are applied after commit.
+
+        Yields ``(conn, changes)``. Inside an outer unit of work the changes
+        wait for the outermost commit.
+        """
+        changes = CatalogChanges()
+        with db.transaction() as conn:
+            if self._loaded:
+                changes.before = conn.execute(_BOOKS_VERSION_SQL).fetchone()[0]
+            yield conn, changes
+            if changes.before is not None:
+                changes.after = conn.execute(_BOOKS_VERSION_SQL).fetchone()[0]
+            db.after_commit(lambda: self.apply(changes))
+
+    def apply(self, changes):
+        """Apply committed changes, or fall back to a reload if they can't be trusted"""
+        with self._lock:
+            if not self._loaded or changes.before is None:
+                return
+            # A version other than ours means someone else wrote in between
+            if changes.before != self._version:
+                self._loaded = False
+                return
+            for op, book_id, value in changes.ops:
+                if op == 'adjust':
+                    position = self._positions.get(book_id)
+                    if position is not None:
+                        self._available[position] += value
+                elif op == 'upsert':
+                    title, author, available = value
+                    position = self._positions.get(book_id)
+                    if (position is not None and self._titles[position] == (title or '')
+                            and self._authors[position] == (author or '')):
+                        self._available[position] = available or 0
+                    else:
+                        self._drop(book_id)
+                        self._append(book_id, title, author, available)
+                else:
+                    self._drop(book_id)
+            self._version = changes.after
+            if (len(self._ids) - self._base > MAX_TAIL
+                    or self._dead > MAX_DEAD_FRACTION * max(len(self._ids), 1)):
+                self._loaded = False
+
+    def invalidate(self):
+        """Drop the index; the next search reloads it"""
+        with self._lock:
+            self._loaded = False
+            self._reset()
+
+    def _word_range(self, words, prefix):
+        return (bisect.bisect_left(words, prefix),
+                bisect.bisect_left(words, prefix + '\U0010ffff'))
+
+    def _count(self, prefix):
+        """Loaded books with a word starting with ``prefix`` (roughly, for planning)"""
+        if len(prefix) <= SHORT_PREFIX:
+            return len(self._short.get(prefix, ()))
+        start, end = self._word_range(self._words, prefix)
+        return self._offsets[end] - self._offsets[start]
+
+    def _base_positions(self, prefix):
+        """Loaded positions with a word starting with ``prefix``, in title order"""
+        if len(prefix) <= SHORT_PREFIX:
+            return iter(self._short.get(prefix, ()))
+        start, end = self._word_range(self._words, prefix)
+        if end - start == 1:
+            return iter(self._postings[self._offsets[start]:self._offsets[end]])
+        # A book can hold two words with the prefix; the caller skips repeats
+        return heapq.merge(*(self._postings[self._offsets[w]:self._offsets[w + 1]]
+                             for w in range(start, end)))
+
+    def _matches(self, position, prefixes):
+        if not prefixes:
+            return True
+        words = tokenize(self._titles[position]) + tokenize(self._authors[position])
+        return all(any(word.startswith(prefix) for word in words) for prefix in prefixes)
+
+    def search(self, text, limit=DEFAULT_LIMIT, available_only=True):
+        """Books whose title/author have a word starting with each word of ``text``.
+
+        Returns up to ``limit`` ``(book_id, title, author, available_copies)``
+        tuples ordered by title.
+        """
+        prefixes = set(tokenize(text))
+        if not prefixes:
+            return []
+        with self._lock:
+            self._ensure_fresh()
+            ids, available = self._ids, self._available
+
+            def wanted(position):
+                return ids[position] and (available[position] > 0 or not available_only)
+
+            # Walk the rarest prefix in title order; check the others per book
+            driver = min(prefixes, key=self._count)
+            others = prefixes - {driver}
+            hits, last = [], -1
+            for position in self._base_positions(driver):
+                if position != last and wanted(position) and self._matches(position, others):
+                    hits.append(position)
+                    if len(hits) == limit:
+                        break
+                last = position
+
+            start, end = self._word_range(self._tail_words, driver)
+            tail = {position for word in self._tail_words[start:end] for position in self._tail[word]}
+            tail = [position for position in tail if wanted(position) and self._matches(position, others)]
+            if tail:
+                hits = sorted(hits + tail, key=lambda p: (self._titles[p], ids[p]))[:limit]
+            return [(ids[p], self._titles[p], self._authors[p], available[p]) for p in hits]
+
+    def stats(self):
+        """Size and memory metrics"""
+        with self._lock:
+            strings = sum(sys.getsizeof(s) for s in self._titles) + \
+                sum(sys.getsizeof(s) for s in self._authors) + \
+                sum(sys.getsizeof(w) for w in self._words)
+            arrays = sum(sys.getsizeof(a) for a in self._short.values())
+            containers = sum(sys.getsizeof(c) for c in (
+                self._ids, self._available, self._titles, self._authors, self._positions,
+                self._words, self._offsets, self._postings, self._short))
+            return {
+                'loaded': self._loaded,
+                'loads': self.loads,
+                'books': len(self._positions),
+                'appended_books': len(self._ids) - self._base,
+                'deleted_positions': self._dead,
+                'words': len(self._words),
+                'bytes': strings + arrays + containers,
+            }
+
+
+def _index_key(db):
+    return os.path.abspath(db.db_name) if db.db_name != ':memory:' else id(db)
+
+
+def get_catalog_index(db, check_interval=DEFAULT_CHECK_INTERVAL):
+    """Get the shared catalog index for ``db``'s database file"""
+    key = _index_key(db)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = CatalogIndex(db, check_interval)
+        return index
@@ -1,26 +1,474 @@
 # database.py
 import sqlite3
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from urllib.request import pathname2url
+from archive import (ArchiveUnavailable, archive_path, attach_archive, create_history_view,
+                     history_includes_archive)
+from instrumentation import get_instruments
+from migrations import migrate, current_version
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_POOL_TIMEOUT = 30.0
+DEFAULT_FETCH_SIZE = 1000
+
+# Environment variable used to pick a profile when none is passed in
+PROFILE_ENV_VAR = 'LIBRARY_DB_PROFILE'
+DEFAULT_PROFILE = 'interactive-desk'
+
+# Named SQLite tuning profiles, applied in order to every new connection.
+# WAL lets report readers run alongside circulation writers.
+PRAGMA_PROFILES = {
+    # Front-desk circulation: durable enough (WAL + NORMAL) and fast commits
+    'interactive-desk': [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('mmap_size', 268435456),
+        ('cache_size', -65536),
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', 5000),
+    ],
+    # Catalog/member imports: throughput over durability, big page cache
+    'bulk-load': [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'OFF'),
+        ('mmap_size', 536870912),
+        ('cache_size', -262144),
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', 30000),
+    ],
+    # Report reader: read-only snapshot connection with a bigger page cache
+    # for full scans; the file itself is opened with mode=ro
+    'report-reader': [
+        ('mmap_size', 268435456),
+        ('cache_size', -131072),
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', 5000),
+        ('query_only', 'ON'),
+    ],
+    # Public catalog terminals: reads only, refuse any write
+    'read-only-kiosk': [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('mmap_size', 268435456),
+        ('cache_size', -32768),
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', 2000),
+        ('query_only', 'ON'),
+    ],
+}
+
+
+# How Report reads: its own mode=ro connections ('wal'), a periodically
+# refreshed in-memory copy ('memory'), or the writer's pool ('shared')
+READER_MODES = ('wal', 'memory', 'shared')
+READER_ENV_VAR = 'LIBRARY_REPORT_READER'
+DEFAULT_READER_MODE = 'wal'
+STALENESS_ENV_VAR = 'LIBRARY_REPORT_MAX_STALENESS'
+DEFAULT_MAX_STALENESS = 60.0
+
+
+# Loan timestamps (issue/due/return) are stored as integer Unix epoch
+# seconds: naive datetimes are local time, as datetime.now() returns them
+def to_epoch(value):
+    """Adapt a datetime to epoch seconds for the loan timestamp columns"""
+    return int(value.timestamp())
+
+
+sqlite3.register_adapter(datetime, to_epoch)
+
+
+def resolve_profile(profile=None):
+    """Return the profile name to use, falling back to the environment"""
+    name = profile or os.environ.get(PROFILE_ENV_VAR) or DEFAULT_PROFILE
+    if name not in PRAGMA_PROFILES:
+        raise ValueError(
+            f"Unknown database profile '{name}'. "
+            f"Choose one of: {', '.join(sorted(PRAGMA_PROFILES))}")
+    return name
+
+
+def apply_pragmas(conn, pragmas):
+    """Apply ``(name, value)`` pragma pairs to an open connection"""
+    for name, value in pragmas:
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def _fetch_all(conn, cursor):
+    rows = cursor.fetchall()
+    return rows, len(rows)
+
+
+def _fetch_one(conn, cursor):
+    row = cursor.fetchone()
+    return row, 1 if row is not None else 0
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by the managers.
+
+    Connections are opened lazily up to ``size`` and handed out one per
+    thread; a thread that already holds a connection gets the same one back
+    when it acquires again, so nested helpers never deadlock the pool.
+    """
+
+    def __init__(self, db_name, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 on_connect=None, read_only=False):
+        # Every connection to ':memory:' is a separate database, so keep one
+        if db_name == ':memory:':
+            size = 1
+        self.db_name = db_name
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self.read_only = read_only and db_name != ':memory:'
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._all = []
+        self._in_use = 0
+        self._high_water = 0
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._closed = False
+
+    def _connect(self):
+        if self.read_only:
+            uri = f'file:{pathname2url(os.path.abspath(self.db_name))}?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _checkout(self):
+        """Take an idle connection, open a new one, or wait for a release"""
+        start = time.perf_counter()
+        conn = None
+        with self._lock:
+            if self._closed:
+                raise PoolTimeout("Connection pool is closed")
+            if self._idle.empty() and len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+        if conn is None:
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeout(
+                    f"No connection available after {self.timeout}s "
+                    f"(pool size {self.size})")
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._acquisitions += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._in_use += 1
+            self._high_water = max(self._high_water, self._in_use)
+        return conn
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._in_use -= 1
+            closed = self._closed
+        if closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Acquire a connection for the current thread and release it on exit"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            if conn.in_transaction:
+                # Never hand a half-finished transaction to the next thread
+                conn.rollback()
+            self._checkin(conn)
+
+    def held(self):
+        """The connection the current thread holds, if any"""
+        return getattr(self._local, 'conn', None)
+
+    def stats(self):
+        """Return pool metrics as a dict"""
+        with self._lock:
+            acquisitions = self._acquisitions
+            return {
+                'size': self.size,
+                'open': len(self._all),
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'high_water': self._high_water,
+                'acquisitions': acquisitions,
+                'timeouts': self._timeouts,
+                'total_wait_ms': self._total_wait * 1000,
+                'avg_wait_ms': (self._total_wait / acquisitions * 1000) if acquisitions else 0.0,
+                'max_wait_ms': self._max_wait * 1000,
+            }
+
+    def close(self):
+        """Close idle connections now; busy ones are closed when released.
+
+        A connection checked out by another thread is left open until that
+        thread's ``connection()`` block exits, so a running query is never
+        cut off. ``stats()['open']`` counts the ones still to be closed.
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
 
 class Database:
-    def __init__(self, db_name='library.db'):
+    def __init__(self, db_name='library.db', pool_size=DEFAULT_POOL_SIZE,
+                 pool_timeout=DEFAULT_POOL_TIMEOUT, profile=None, instruments=None,
+                 archive_name=None, read_only=False):
         self.db_name = db_name
-        self.connection = None
-        self.cursor = None
-        
+        self.archive_name = archive_name or archive_path(db_name)
+        self.read_only = read_only
+        self.profile = resolve_profile(profile)
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.instruments = instruments or get_instruments(db_name)
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_pool(self):
+        """Get (and lazily create) the connection pool"""
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    self.pool = ConnectionPool(self.db_name, self.pool_size,
+                                               self.pool_timeout, self._configure,
+                                               self.read_only)
+        return self.pool
+
+    def _configure(self, conn):
+        """Apply the selected pragma profile to a freshly opened connection"""
+        pragmas = PRAGMA_PROFILES[self.profile]
+        apply_pragmas(conn, [p for p in pragmas if p[0] != 'query_only'])
+        # After temp_store (which resets the temp schema) but before
+        # query_only (which would refuse even a temp view)
+        attach_archive(conn, self.archive_name)
+        create_history_view(conn)
+        apply_pragmas(conn, [p for p in pragmas if p[0] == 'query_only'])
+
+    def effective_pragmas(self):
+        """Read back the pragma values SQLite is actually using"""
+        with self.get_connection() as conn:
+            return {
+                name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+                for name, _ in PRAGMA_PROFILES[self.profile]
+            }
+
     def get_connection(self):
-        """Get database connection"""
-        if not self.connection:
-            self.connection = sqlite3.connect(self.db_name, check_same_thread=False)
-            self.cursor = self.connection.cursor()
-        return self.connection
+        """Get a pooled database connection.
+
+        Use as a context manager: the connection is returned to the pool
+        when the block exits.
+        """
+        return self.get_pool().connection()
+
+    @contextmanager
+    def transaction(self):
+        """Run a block as a single BEGIN IMMEDIATE ... COMMIT unit.
+
+        Yields the connection, wrapped so its statements are recorded by
+        the instruments. Nested blocks on the same thread join the outer
+        transaction as a savepoint: an exception rolls back just the nested
+        block, and rolls back the whole unit if it reaches the outermost one.
+        """
+        with self.get_connection() as conn:
+            if self.in_transaction():
+                depth = self._local.tx_depth
+                callbacks = len(self._local.after_commit)
+                conn.execute(f'SAVEPOINT tx_{depth}')
+                self._local.tx_depth += 1
+                try:
+                    yield self.instruments.wrap(conn)
+                    conn.execute(f'RELEASE SAVEPOINT tx_{depth}')
+                except BaseException:
+                    # SQLite may already have rolled back the whole transaction
+                    if conn.in_transaction:
+                        conn.execute(f'ROLLBACK TO SAVEPOINT tx_{depth}')
+                        conn.execute(f'RELEASE SAVEPOINT tx_{depth}')
+                    del self._local.after_commit[callbacks:]
+                    raise
+                finally:
+                    self._local.tx_depth = depth
+                return
+
+            # BEGIN and COMMIT are recorded too: lock waits and syncs show up there
+            recorded = self.instruments.wrap(conn)
+            recorded.execute('BEGIN IMMEDIATE')
+            self._local.tx_depth = 1
+            self._local.after_commit = []
+            try:
+                yield recorded
+                recorded.execute('COMMIT')
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._local.tx_depth = 0
+                callbacks, self._local.after_commit = self._local.after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def after_commit(self, callback):
+        """Call ``callback()`` once the current transaction commits.
+
+        Outside ``transaction()`` it is called right away; callbacks of a
+        nested block that rolls back, or of a unit that rolls back, are
+        dropped.
+        """
+        if self.in_transaction():
+            self._local.after_commit.append(callback)
+        else:
+            callback()
+
+    @contextmanager
+    def snapshot(self):
+        """Read a block of queries from one consistent snapshot.
+
+        Opens a read transaction on the thread's connection; every query in
+        the block (including nested manager calls on this thread) sees the
+        database as of the first read, whatever commits meanwhile. Yields
+        the connection wrapped like ``transaction()`` does.
+        """
+        with self.get_connection() as conn:
+            if conn.in_transaction:
+                yield self.instruments.wrap(conn)
+                return
+            conn.execute('BEGIN')
+            # A deferred transaction takes its snapshot at the first read
+            conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+            try:
+                yield self.instruments.wrap(conn)
+            finally:
+                conn.rollback()
+
+    def query_only(self):
+        """Check whether connections refuse writes"""
+        return self.read_only or ('query_only', 'ON') in PRAGMA_PROFILES[self.profile]
+
+    def staleness(self):
+        """Seconds the data read here may lag the database file (0 for live reads)"""
+        return 0.0
+
+    def in_transaction(self):
+        """Check whether the current thread is inside ``transaction()``"""
+        return getattr(self._local, 'tx_depth', 0) > 0
+
+    def history_source(self, conn, include_archive=False):
+        """Name of the loan table to read: hot ``transactions`` or ``all_transactions``.
+
+        The archive may have been created after ``conn`` was opened, so it
+        is attached (and the view rebuilt) on demand, read-only connections
+        included. Raises ``ArchiveUnavailable`` rather than quietly reading
+        hot rows only when an archive exists but can't be attached here.
+        """
+        if not include_archive:
+            return 'transactions'
+        # Without an archive file the hot table is the full history
+        if (not self.archive_name or not os.path.exists(self.archive_name)
+                or history_includes_archive(conn)):
+            return 'all_transactions'
+        if conn.in_transaction:
+            raise ArchiveUnavailable(
+                f"Archive {self.archive_name} appeared after this snapshot began; "
+                f"read full history outside the snapshot")
+        # ATTACH is allowed under query_only, but the temp view is not
+        attach_archive(conn, self.archive_name)
+        query_only = conn.execute('PRAGMA query_only').fetchone()[0]
+        if query_only:
+            conn.execute('PRAGMA query_only = OFF')
+        try:
+            create_history_view(conn)
+        finally:
+            if query_only:
+                conn.execute('PRAGMA query_only = ON')
+        if not history_includes_archive(conn):
+            raise ArchiveUnavailable(f"Archive {self.archive_name} has no transactions table")
+        return 'all_transactions'
+
+    def pool_stats(self):
+        """Get connection pool metrics"""
+        return self.get_pool().stats()
+
+    def add_query_hooks(self, before=None, after=None):
+        """Register callables run before and after every statement"""
+        self.instruments.add_hooks(before, after)
+
+    def query_stats(self, top=20, order_by='total_ms'):
+        """Get the top statements by total time (or calls, max_ms, ...)"""
+        return self.instruments.top_queries(top, order_by)
+
+    def slow_queries(self):
+        """Get recent slow statements with their EXPLAIN QUERY PLAN"""
+        return self.instruments.slow_queries()
+
+    def query_errors(self):
+        """Get recent failed statements"""
+        return self.instruments.errors()
     
     def create_tables(self):
-        """Create database tables"""
-        conn = self.get_connection()
-        cursor = self.cursor
-        
+        """Create database tables and upgrade the schema to the latest version"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._create_tables(cursor)
+            conn.commit()
+            migrate(conn)
+        return True
+
+    def schema_version(self):
+        """Get the applied schema migration version"""
+        with self.get_connection() as conn:
+            return current_version(conn)
+
+    def _create_tables(self, cursor):
+        """Run the table DDL and default settings on ``cursor``"""
+
         # Books table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS books (
@@ -56,9 +504,9 @@ class Database:
                 transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 book_id INTEGER NOT NULL,
                 member_id INTEGER NOT NULL,
-                issue_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                due_date TIMESTAMP,
-                return_date TIMESTAMP,
+                issue_date INTEGER DEFAULT (unixepoch()),
+                due_date INTEGER,
+                return_date INTEGER,
                 fine_amount REAL DEFAULT 0.0,
                 fine_paid BOOLEAN DEFAULT FALSE,
                 FOREIGN KEY (book_id) REFERENCES books (book_id),
@@ -91,46 +539,159 @@ class Database:
                 INSERT OR IGNORE INTO settings (setting_name, setting_value)
                 VALUES (?, ?)
             ''', setting)
-        
-        conn.commit()
-        return True
     
+    def _run(self, operation, query, params, handle):
+        """Execute ``query``, pass the cursor to ``handle`` and record it.
+
+        ``handle(conn, cursor)`` returns ``(result, rows)``. Errors are
+        recorded and re-raised for the caller to turn into its fallback.
+        """
+        instruments = self.instruments
+        try:
+            with self.get_connection() as conn:
+                instruments.before(operation, query, params)
+                start = time.perf_counter()
+                try:
+                    result, rows = handle(conn, conn.execute(query, params))
+                except Exception as e:
+                    instruments.record(conn, operation, query, params,
+                                       (time.perf_counter() - start) * 1000, error=e)
+                    raise
+                instruments.record(conn, operation, query, params,
+                                   (time.perf_counter() - start) * 1000, rows)
+                return result
+        except PoolTimeout as e:
+            instruments.record(None, operation, query, params, 0.0, error=e)
+            raise
+
+    def _commit(self, conn, cursor):
+        # Inside transaction() the outer block owns the commit
+        if not self.in_transaction():
+            conn.commit()
+        return True, max(cursor.rowcount, 0)
+
     def execute_query(self, query, params=()):
         """Execute SQL query"""
         try:
-            conn = self.get_connection()
-            cursor = self.cursor
-            cursor.execute(query, params)
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Database error: {e}")
+            return self._run('execute', query, params, self._commit)
+        except Exception:
             return False
     
     def fetch_all(self, query, params=()):
         """Fetch all results"""
         try:
-            conn = self.get_connection()
-            cursor = self.cursor
-            cursor.execute(query, params)
-            return cursor.fetchall()
-        except Exception as e:
-            print(f"Database fetch error: {e}")
+            return self._run('fetch_all', query, params, _fetch_all)
+        except Exception:
             return []
     
     def fetch_one(self, query, params=()):
         """Fetch one result"""
         try:
-            conn = self.get_connection()
-            cursor = self.cursor
-            cursor.execute(query, params)
-            return cursor.fetchone()
-        except Exception as e:
-            print(f"Database fetch error: {e}")
+            return self._run('fetch_one', query, params, _fetch_one)
+        except Exception:
             return None
     
+    def iter_chunks(self, query, params=(), chunk_size=DEFAULT_FETCH_SIZE):
+        """Yield the result of ``query`` as lists of at most ``chunk_size`` rows.
+
+        Rows are pulled with ``fetchmany`` so memory stays flat however
+        large the result is. The pooled connection (and its read snapshot)
+        is held until the generator is exhausted or closed. Unlike the
+        ``fetch_*`` helpers, errors are raised: a silently short export is
+        worse than a failed one.
+        """
+        instruments = self.instruments
+        with self.get_connection() as conn:
+            instruments.before('iterate', query, params)
+            # Only time spent in SQLite counts, not the consumer's work
+            elapsed = 0.0
+            rows = 0
+            try:
+                start = time.perf_counter()
+                cursor = conn.execute(query, params)
+                while True:
+                    chunk = cursor.fetchmany(chunk_size)
+                    elapsed += time.perf_counter() - start
+                    if not chunk:
+                        break
+                    rows += len(chunk)
+                    yield chunk
+                    start = time.perf_counter()
+            except Exception as e:
+                instruments.record(conn, 'iterate', query, params, elapsed * 1000, rows, error=e)
+                raise
+            instruments.record(conn, 'iterate', query, params, elapsed * 1000, rows)
+
     def close(self):
-        """Close database connection"""
-        if self.connection:
-            self.connection.close()
-            self.connection = None
+        """Close the pool: idle connections now, busy ones when released"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+class SnapshotDatabase(Database):
+    """In-memory copy of a database file made with the SQLite backup API.
+
+    The copy is refreshed on first use after ``max_staleness`` seconds, so
+    readers never take locks on the source file between refreshes. The
+    copy lives in one connection; queries from several threads take turns.
+    """
+
+    def __init__(self, source_name, max_staleness=DEFAULT_MAX_STALENESS,
+                 pool_timeout=DEFAULT_POOL_TIMEOUT, archive_name=None, instruments=None):
+        super().__init__(':memory:', pool_size=1, pool_timeout=pool_timeout,
+                         profile='report-reader', instruments=instruments,
+                         archive_name=archive_name or archive_path(source_name))
+        self.source_name = source_name
+        self.max_staleness = max_staleness
+        self.refreshed_at = None
+        self.refreshes = 0
+        self._refresh_lock = threading.Lock()
+
+    def get_connection(self):
+        # Only refresh between queries: a thread already holding the single
+        # connection must not wait on a refresh that needs it
+        if self.get_pool().held() is None:
+            self.refresh(force=False)
+        return super().get_connection()
+
+    def refresh(self, force=True):
+        """Copy the source file into memory if forced or the copy is stale"""
+        if not force and self.staleness() < self.max_staleness:
+            return False
+        with self._refresh_lock:
+            if not force and self.staleness() < self.max_staleness:
+                return False
+            with super().get_connection() as conn:
+                uri = f'file:{pathname2url(os.path.abspath(self.source_name))}?mode=ro'
+                source = sqlite3.connect(uri, uri=True)
+                try:
+                    # The temp all_transactions view survives: only main is replaced
+                    source.backup(conn)
+                finally:
+                    source.close()
+            self.refreshed_at = time.monotonic()
+            self.refreshes += 1
+            return True
+
+    def staleness(self):
+        """Seconds since the in-memory copy was taken (inf before the first)"""
+        if self.refreshed_at is None:
+            return float('inf')
+        return time.monotonic() - self.refreshed_at
+
+
+def open_reader(db, mode=None, max_staleness=None):
+    """Build the read-side ``Database`` for reports on ``db``'s file"""
+    mode = mode or os.environ.get(READER_ENV_VAR) or DEFAULT_READER_MODE
+    if mode not in READER_MODES:
+        raise ValueError(f"Unknown reader mode '{mode}'. Choose one of: {', '.join(READER_MODES)}")
+    if mode == 'shared' or db.db_name == ':memory:':
+        return db
+    if mode == 'memory':
+        if max_staleness is None:
+            max_staleness = float(os.environ.get(STALENESS_ENV_VAR, DEFAULT_MAX_STALENESS))
+        return SnapshotDatabase(db.db_name, max_staleness, db.pool_timeout, db.archive_name,
+                                db.instruments)
+    return Database(db.db_name, db.pool_size, db.pool_timeout, profile='report-reader',
+                    instruments=db.instruments, archive_name=db.archive_name, read_only=True)
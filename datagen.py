@@ -0,0 +1,170 @@
+# datagen.py
+"""Reproducible synthetic library generator.
+
+    python datagen.py bench.db --books 1000000 --members 200000 --transactions 10000000
+
+Borrowing follows a Zipf-like skew: a few titles and a few readers account
+for most loans, as in a real branch. Loans are spread over ``--years`` of
+history; most are returned (some late, with fines), and a small share are
+still open, some of them overdue. Copy counts, member borrow totals and
+loan limits stay consistent with the generated loans. The same seed always
+produces the same library.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from database import Database
+
+CHUNK_SIZE = 20000
+CATEGORIES = ('Fiction', 'Non-Fiction', 'Science', 'History', 'Technology', 'Arts', 'Other')
+MEMBERSHIP_TYPES = ('Regular', 'Regular', 'Regular', 'Student', 'Student', 'Premium')
+TITLE_WORDS = (
+    'night', 'river', 'shadow', 'garden', 'empire', 'silent', 'winter', 'secret', 'history',
+    'light', 'stone', 'ocean', 'forgotten', 'city', 'dream', 'fire', 'glass', 'machine',
+    'kingdom', 'journey', 'letters', 'science', 'mountain', 'last', 'house', 'storm', 'code',
+    'island', 'memory', 'iron', 'golden', 'wild', 'hidden', 'quiet', 'broken', 'road',
+)
+FIRST_NAMES = (
+    'Ada', 'Alan', 'Amara', 'Ben', 'Chen', 'Dara', 'Elena', 'Femi', 'Grace', 'Hiro', 'Ines',
+    'Jamal', 'Kofi', 'Lena', 'Maya', 'Nikos', 'Olu', 'Priya', 'Quinn', 'Rosa', 'Sam', 'Tara',
+    'Uma', 'Victor', 'Wei', 'Xena', 'Yusuf', 'Zoe',
+)
+LAST_NAMES = (
+    'Adeyemi', 'Brown', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Hughes', 'Ivanova',
+    'Jones', 'Kim', 'Lopez', 'Mensah', 'Nakamura', 'Okafor', 'Patel', 'Rossi', 'Silva',
+    'Smith', 'Tanaka', 'Usman', 'Volkov', 'Wang', 'Xu', 'Yilmaz', 'Zhang',
+)
+
+
+def isbn13(n):
+    """A checksum-valid ISBN-13 derived from ``n``"""
+    body = '978' + str(n).zfill(9)
+    total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def zipf_weights(n, s=1.1):
+    """Cumulative Zipf weights for ``random.choices``"""
+    cumulative, total = [], 0.0
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** s
+        cumulative.append(total)
+    return cumulative
+
+
+def generate_library(db_name, books=10000, members=2000, transactions=100000, seed=42,
+                     years=3, open_fraction=0.05, max_open_per_member=5, now=None):
+    """Populate ``db_name`` with a synthetic library and return its sizes"""
+    rng = random.Random(seed)
+    now = now or datetime(2026, 1, 1)
+    db = Database(db_name, pool_size=1, profile='bulk-load')
+    db.create_tables()
+    started = time.perf_counter()
+
+    copies = [rng.choice((1, 1, 1, 2, 2, 3, 5)) for _ in range(books)]
+    with db.transaction() as conn:
+        for start in range(0, books, CHUNK_SIZE):
+            conn.executemany('''
+                INSERT INTO books (title, author, isbn, category, total_copies, available_copies, publication_year)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(' '.join(rng.sample(TITLE_WORDS, rng.randint(2, 4))).title() + f' {i}',
+                   f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                   isbn13(i), rng.choice(CATEGORIES), copies[i], copies[i],
+                   rng.randint(1950, now.year))
+                  for i in range(start, min(start + CHUNK_SIZE, books))])
+
+    with db.transaction() as conn:
+        for start in range(0, members, CHUNK_SIZE):
+            conn.executemany('''
+                INSERT INTO members (name, email, phone, membership_type, join_date, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                   f'member{i}@example.org',
+                   f'555{rng.randint(0, 9999999):07d}',
+                   rng.choice(MEMBERSHIP_TYPES),
+                   (now - timedelta(days=rng.randint(0, years * 365))).strftime('%Y-%m-%d %H:%M:%S'),
+                   'Active' if rng.random() < 0.95 else 'Inactive')
+                  for i in range(start, min(start + CHUNK_SIZE, members))])
+
+    # Popular titles and heavy readers are shuffled so ids don't predict rank
+    book_rank = list(range(1, books + 1))
+    member_rank = list(range(1, members + 1))
+    rng.shuffle(book_rank)
+    rng.shuffle(member_rank)
+    book_weights = zipf_weights(books)
+    member_weights = zipf_weights(members, s=0.8)
+
+    available = list(copies)
+    open_loans = [0] * members
+    borrowed = [0] * members
+    history = timedelta(days=years * 365)
+    open_count = 0
+    for start in range(0, transactions, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, transactions - start)
+        book_picks = rng.choices(range(books), cum_weights=book_weights, k=size)
+        member_picks = rng.choices(range(members), cum_weights=member_weights, k=size)
+        rows = []
+        for b, m in zip(book_picks, member_picks):
+            book_id, member_id = book_rank[b], member_rank[m]
+            want_open = rng.random() < open_fraction
+            if want_open and available[book_id - 1] > 0 and open_loans[member_id - 1] < max_open_per_member:
+                # Open loans are recent; a share are already overdue
+                issue_date = now - timedelta(days=rng.randint(0, 30), seconds=rng.randint(0, 86399))
+                due_date = issue_date + timedelta(days=14)
+                available[book_id - 1] -= 1
+                open_loans[member_id - 1] += 1
+                return_date, fine, paid = None, 0.0, False
+                open_count += 1
+            else:
+                issue_date = now - timedelta(seconds=rng.randint(31 * 86400, int(history.total_seconds())))
+                due_date = issue_date + timedelta(days=14)
+                late_days = rng.randint(1, 30) if rng.random() < 0.1 else 0
+                return_date = issue_date + timedelta(days=rng.randint(1, 14) + late_days)
+                fine = float(min(max(late_days - 2, 0) * 1.0, 20.0))
+                paid = fine > 0 and rng.random() < 0.7
+            borrowed[member_id - 1] += 1
+            # datetimes are stored as epoch seconds by the adapter in database.py
+            rows.append((book_id, member_id, issue_date, due_date, return_date, fine, paid))
+        with db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO transactions (book_id, member_id, issue_date, due_date, return_date, fine_amount, fine_paid)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+    with db.transaction() as conn:
+        conn.executemany('UPDATE books SET available_copies = ? WHERE book_id = ?',
+                         [(count, book_id) for book_id, count in enumerate(available, start=1)
+                          if count != copies[book_id - 1]])
+        conn.executemany('UPDATE members SET total_books_borrowed = ? WHERE member_id = ?',
+                         [(count, member_id) for member_id, count in enumerate(borrowed, start=1)
+                          if count])
+    db.close()
+    return {
+        'books': books,
+        'members': members,
+        'transactions': transactions,
+        'open_loans': open_count,
+        'seed': seed,
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic library database')
+    parser.add_argument('db', help='database file to create or extend')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    print(generate_library(args.db, args.books, args.members, args.transactions,
+                           args.seed, args.years))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
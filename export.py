@@ -0,0 +1,198 @@
+# export.py
+"""Streaming export of circulation history and reports.
+
+    python export.py transactions --out transactions.csv
+    python export.py transactions --out tx.parquet --state export_state.json
+    python export.py overdue-books --out - > overdue.csv
+
+Rows are pulled from SQLite in ``fetchmany`` chunks and written as they
+arrive, so memory stays flat however many years of history are exported.
+CSV is always available; Parquet needs ``pyarrow``.
+
+The ``transactions`` export is incremental: ``--since-id`` skips loans up
+to that id, and ``--state`` remembers the last exported id for the next
+nightly run. Loans are exported as of the run, so a later return of an
+already exported loan is not re-sent. Files are written under a
+``.partial`` name and renamed on success; the state file only advances
+after that rename.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from database import Database, DEFAULT_FETCH_SIZE
+from repository import Library
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# name -> (columns with their types, function(library, since_id, chunk_size) -> chunks)
+EXPORTS = {
+    'transactions': (
+        (('transaction_id', 'int'), ('book_id', 'int'), ('title', 'str'), ('member_id', 'int'),
+         ('member_name', 'str'), ('issue_date', 'str'), ('due_date', 'str'),
+         ('return_date', 'str'), ('fine_amount', 'float'), ('fine_paid', 'bool')),
+        lambda library, since_id, chunk_size: library.transaction.iter_transactions(since_id, chunk_size),
+    ),
+    'member-statistics': (
+        (('member_id', 'int'), ('name', 'str'), ('email', 'str'), ('total_borrowed', 'int'),
+         ('current_loans', 'int'), ('total_fines', 'float'), ('unpaid_fines', 'float')),
+        lambda library, since_id, chunk_size: library.report.iter_member_statistics(chunk_size),
+    ),
+    'overdue-books': (
+        (('transaction_id', 'int'), ('title', 'str'), ('member_name', 'str'), ('email', 'str'),
+         ('issue_date', 'str'), ('due_date', 'str'), ('days_overdue', 'float'),
+         ('fine_amount', 'float')),
+        lambda library, since_id, chunk_size: library.report.iter_overdue_books(chunk_size),
+    ),
+}
+
+# Only these exports are ordered by transaction_id and can resume
+RESUMABLE = ('transactions',)
+
+
+class ExportError(Exception):
+    """Export could not be started"""
+
+
+def write_csv(chunks, columns, out):
+    """Write chunks of rows to an open text file; returns (rows, last row)"""
+    writer = csv.writer(out)
+    writer.writerow(name for name, _ in columns)
+    rows, last = 0, None
+    for chunk in chunks:
+        writer.writerows(chunk)
+        rows += len(chunk)
+        last = chunk[-1]
+    return rows, last
+
+
+def write_parquet(chunks, columns, path):
+    """Write each chunk as one Parquet row group; returns (rows, last row)"""
+    if pyarrow is None:
+        raise ExportError('Parquet export needs pyarrow (pip install pyarrow)')
+    types = {'int': pyarrow.int64(), 'float': pyarrow.float64(),
+             'str': pyarrow.string(), 'bool': pyarrow.bool_()}
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+    rows, last = 0, None
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            arrays = [
+                pyarrow.array([None if row[i] is None else _coerce(row[i], kind) for row in chunk],
+                              type=types[kind])
+                for i, (_, kind) in enumerate(columns)
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+            last = chunk[-1]
+    return rows, last
+
+
+def _coerce(value, kind):
+    # SQLite hands back whatever was stored; Parquet columns are strict
+    if kind == 'bool':
+        return bool(value)
+    if kind == 'str':
+        return str(value)
+    return value
+
+
+def read_state(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_state(path, state):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def export(name, out, db_name='library.db', fmt=None, chunk_size=DEFAULT_FETCH_SIZE,
+           since_id=None, state_path=None):
+    """Stream export ``name`` to ``out`` ('-' for stdout) and return a summary"""
+    if name not in EXPORTS:
+        raise ExportError(f"Unknown export '{name}' (choose from {', '.join(EXPORTS)})")
+    fmt = fmt or ('parquet' if out.endswith('.parquet') else 'csv')
+    if fmt == 'parquet' and out == '-':
+        raise ExportError('Parquet cannot be written to stdout')
+    if (since_id is not None or state_path) and name not in RESUMABLE:
+        raise ExportError(f"'{name}' is a full snapshot and cannot resume")
+
+    state = read_state(state_path)
+    if since_id is None:
+        since_id = state.get(name, {}).get('last_transaction_id', 0)
+
+    columns, source = EXPORTS[name]
+    # One set of managers; close() also closes the report's reader
+    library = Library(Database(db_name, pool_size=1, profile='read-only-kiosk'))
+    start = time.perf_counter()
+    chunks = source(library, since_id, chunk_size)
+    try:
+        if out == '-':
+            rows, last = write_csv(chunks, columns, sys.stdout)
+        else:
+            partial = f'{out}.partial'
+            try:
+                if fmt == 'parquet':
+                    rows, last = write_parquet(chunks, columns, partial)
+                else:
+                    with open(partial, 'w', newline='', encoding='utf-8') as f:
+                        rows, last = write_csv(chunks, columns, f)
+            except BaseException:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                raise
+            os.replace(partial, out)
+    finally:
+        chunks.close()
+        library.close()
+
+    summary = {
+        'export': name,
+        'format': fmt,
+        'out': out,
+        'rows': rows,
+        'elapsed_seconds': round(time.perf_counter() - start, 3),
+    }
+    if name in RESUMABLE:
+        summary['since_transaction_id'] = since_id
+        summary['last_transaction_id'] = last[0] if last else since_id
+        if state_path:
+            state[name] = {'last_transaction_id': summary['last_transaction_id'],
+                           'exported_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+            write_state(state_path, state)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream library data to CSV or Parquet')
+    parser.add_argument('export', choices=tuple(EXPORTS))
+    parser.add_argument('--db', default='library.db', help='database file (default: library.db)')
+    parser.add_argument('--out', required=True, help="output file, or '-' for CSV on stdout")
+    parser.add_argument('--format', choices=('csv', 'parquet'), help='default: by extension')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_FETCH_SIZE)
+    parser.add_argument('--since-id', type=int, help='only loans after this transaction_id')
+    parser.add_argument('--state', help='JSON file remembering the last exported transaction_id')
+    args = parser.parse_args(argv)
+    try:
+        summary = export(args.export, args.out, args.db, args.format, args.chunk_size,
+                         args.since_id, args.state)
+    except ExportError as e:
+        print(f'Export failed: {e}', file=sys.stderr)
+        return 2
+    print(json.dumps(summary, indent=2), file=sys.stderr if args.out == '-' else sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+# instrumentation.py
+"""Statement timing, slow-query log and error channel for ``Database``.
+
+Every ``execute_query``/``fetch_all``/``fetch_one`` call, and every
+``execute``/``executemany`` on the connection yielded by
+``Database.transaction()`` or ``Database.snapshot()``, is timed and folded
+into per-statement totals keyed by normalized SQL (literals and
+placeholder lists collapsed), so the same query with different values
+counts once. Statements slower than ``slow_query_ms`` are kept with their
+``EXPLAIN QUERY PLAN``. Errors go to the ``library.db`` logger and a
+bounded in-memory list instead of stdout. Instruments are shared per
+database file, like the settings cache, so several ``Database`` objects on
+one file report together.
+"""
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+DEFAULT_SLOW_QUERY_MS = 100.0
+SLOW_QUERY_ENV_VAR = 'LIBRARY_DB_SLOW_MS'
+MAX_SLOW_QUERIES = 200
+MAX_ERRORS = 200
+
+logger = logging.getLogger('library.db')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_instruments = {}
+_instruments_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Collapse whitespace, literals and placeholder lists into one shape"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('(?, ...)', sql)
+
+
+class _StatementStats:
+    __slots__ = ('calls', 'errors', 'rows', 'total_ms', 'max_ms', 'slow')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow = 0
+
+
+class InstrumentedConnection:
+    """``sqlite3.Connection`` proxy whose ``execute``/``executemany`` are recorded.
+
+    Everything else (``commit``, ``in_transaction``, ...) goes straight to
+    the wrapped connection. Rows are counted for writes only; a SELECT's
+    rows are fetched after the call returns.
+    """
+    __slots__ = ('_conn', '_instruments')
+
+    def __init__(self, conn, instruments):
+        self._conn = conn
+        self._instruments = instruments
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def _run(self, operation, method, sql, params, recorded_params):
+        instruments = self._instruments
+        instruments.before(operation, sql, recorded_params)
+        start = time.perf_counter()
+        try:
+            cursor = method(sql, params)
+        except Exception as e:
+            instruments.record(self._conn, operation, sql, recorded_params,
+                               (time.perf_counter() - start) * 1000, error=e)
+            raise
+        instruments.record(self._conn, operation, sql, recorded_params,
+                           (time.perf_counter() - start) * 1000, max(cursor.rowcount, 0))
+        return cursor
+
+    def execute(self, sql, params=()):
+        return self._run('execute', self._conn.execute, sql, params, params)
+
+    def executemany(self, sql, seq_of_params):
+        # The parameter rows may be a one-shot generator, so hooks get None
+        return self._run('executemany', self._conn.executemany, sql, seq_of_params, None)
+
+
+class QueryInstruments:
+    def __init__(self, slow_query_ms=None):
+        if slow_query_ms is None:
+            slow_query_ms = float(os.environ.get(SLOW_QUERY_ENV_VAR, DEFAULT_SLOW_QUERY_MS))
+        self.slow_query_ms = slow_query_ms
+        self._before = []
+        self._after = []
+        self._stats = {}
+        self._slow = deque(maxlen=MAX_SLOW_QUERIES)
+        self._errors = deque(maxlen=MAX_ERRORS)
+        self._lock = threading.Lock()
+
+    def add_hooks(self, before=None, after=None):
+        """Register callables run around every statement.
+
+        ``before(operation, sql, params)`` runs just before execution;
+        ``after(event)`` gets a dict with ``operation``, ``sql``,
+        ``normalized``, ``params``, ``elapsed_ms``, ``rows`` and ``error``.
+        ``params`` is None for ``executemany``.
+        """
+        if before is not None:
+            self._before.append(before)
+        if after is not None:
+            self._after.append(after)
+
+    def remove_hooks(self, before=None, after=None):
+        if before in self._before:
+            self._before.remove(before)
+        if after in self._after:
+            self._after.remove(after)
+
+    def wrap(self, conn):
+        """Proxy ``conn`` so its statements are recorded here"""
+        return InstrumentedConnection(conn, self)
+
+    def before(self, operation, sql, params):
+        for hook in list(self._before):
+            self._call_hook(hook, operation, sql, params)
+
+    def record(self, conn, operation, sql, params, elapsed_ms, rows=0, error=None):
+        """Fold one finished statement into the totals and notify hooks"""
+        normalized = normalize_sql(sql)
+        slow = elapsed_ms >= self.slow_query_ms and error is None
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                stats = self._stats[normalized] = _StatementStats()
+            stats.calls += 1
+            stats.rows += rows
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            if error is not None:
+                stats.errors += 1
+            if slow:
+                stats.slow += 1
+        if slow:
+            self._log_slow(conn, operation, sql, normalized, params, elapsed_ms)
+        if error is not None:
+            self._log_error(operation, sql, normalized, params, error)
+        event = {
+            'operation': operation,
+            'sql': sql,
+            'normalized': normalized,
+            'params': params,
+            'elapsed_ms': elapsed_ms,
+            'rows': rows,
+            'error': error,
+        }
+        for hook in list(self._after):
+            self._call_hook(hook, event)
+
+    def _call_hook(self, hook, *args):
+        # A broken hook must never break the query it observes
+        try:
+            hook(*args)
+        except Exception:
+            logger.exception('Query hook %r failed', hook)
+
+    def _log_slow(self, conn, operation, sql, normalized, params, elapsed_ms):
+        if params is None:
+            # executemany: no parameter row left to bind the plan with
+            plan = ['(no plan: executemany)']
+        else:
+            try:
+                plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+            except Exception as e:
+                plan = [f'(no plan: {e})']
+        entry = {
+            'at': time.time(),
+            'operation': operation,
+            'normalized': normalized,
+            'params': repr(params),
+            'elapsed_ms': round(elapsed_ms, 3),
+            'plan': plan,
+        }
+        with self._lock:
+            self._slow.append(entry)
+        logger.warning('Slow query (%.1f ms): %s | plan: %s', elapsed_ms, normalized, '; '.join(plan))
+
+    def _log_error(self, operation, sql, normalized, params, error):
+        entry = {
+            'at': time.time(),
+            'operation': operation,
+            'normalized': normalized,
+            'params': repr(params),
+            'error': f'{type(error).__name__}: {error}',
+        }
+        with self._lock:
+            self._errors.append(entry)
+        logger.error('Database %s error: %s | %s', operation, entry['error'], normalized)
+
+    def top_queries(self, n=20, order_by='total_ms'):
+        """The ``n`` statements with the highest ``order_by`` value"""
+        with self._lock:
+            rows = [{
+                'normalized': sql,
+                'calls': s.calls,
+                'errors': s.errors,
+                'slow': s.slow,
+                'rows': s.rows,
+                'total_ms': round(s.total_ms, 3),
+                'mean_ms': round(s.total_ms / s.calls, 3) if s.calls else 0.0,
+                'max_ms': round(s.max_ms, 3),
+            } for sql, s in self._stats.items()]
+        rows.sort(key=lambda row: row[order_by], reverse=True)
+        return rows[:n]
+
+    def slow_queries(self):
+        """Recent slow statements with their query plans, newest last"""
+        with self._lock:
+            return list(self._slow)
+
+    def errors(self):
+        """Recent failed statements, newest last"""
+        with self._lock:
+            return list(self._errors)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+            self._errors.clear()
+
+
+def get_instruments(db_name):
+    """Get the shared instruments for a database file"""
+    key = os.path.abspath(db_name) if db_name != ':memory:' else None
+    if key is None:
+        return QueryInstruments()
+    with _instruments_lock:
+        instruments = _instruments.get(key)
+        if instruments is None:
+            instruments = _instruments[key] = QueryInstruments()
+        return instruments
@@ -0,0 +1,95 @@
+# maintenance.py
+"""Headless maintenance commands for library.db.
+
+    python maintenance.py reconcile-counters
+    python maintenance.py --db branch.db reconcile-counters
+    python maintenance.py rebuild-popularity
+    python maintenance.py refresh-activity
+    python maintenance.py archive-transactions --older-than-days 365
+    python maintenance.py accrue-fines
+"""
+import argparse
+import json
+import sys
+import time
+
+from archive import DEFAULT_ARCHIVE_AGE_DAYS, DEFAULT_ARCHIVE_CHUNK, archive_stats, archive_transactions
+from repository import Library
+from transaction import BATCH_SIZE
+
+
+def reconcile_counters(library, args):
+    """Rebuild dashboard counters and report any drift"""
+    drift = library.report.reconcile_counters()
+    return {'drift': drift}
+
+
+def rebuild_popularity(library, args):
+    """Backfill borrow-count rollups from the transactions table"""
+    library.report.rebuild_popularity()
+    return {'rebuilt': True}
+
+
+def refresh_activity(library, args):
+    """Fold new and changed transactions into the daily activity rollup"""
+    return {'days_refreshed': library.report.refresh_activity()}
+
+
+def archive(library, args):
+    """Move long-settled loans into the archive database"""
+    result = archive_transactions(library.db, args.older_than_days, args.chunk_size, args.pause)
+    result.update(archive_stats(library.db))
+    return result
+
+
+def accrue_fines(library, args):
+    """Write the current overdue fine onto every open overdue loan"""
+    return library.transaction.accrue_fines(args.chunk_size, args.pause)
+
+
+COMMANDS = {
+    'reconcile-counters': reconcile_counters,
+    'rebuild-popularity': rebuild_popularity,
+    'refresh-activity': refresh_activity,
+    'archive-transactions': archive,
+    'accrue-fines': accrue_fines,
+}
+
+# Extra command-line options per command
+OPTIONS = {
+    'archive-transactions': [
+        ('--older-than-days', {'type': int, 'default': DEFAULT_ARCHIVE_AGE_DAYS}),
+        ('--chunk-size', {'type': int, 'default': DEFAULT_ARCHIVE_CHUNK}),
+        ('--pause', {'type': float, 'default': 0.05, 'help': 'seconds to yield the write lock between chunks'}),
+    ],
+    'accrue-fines': [
+        ('--chunk-size', {'type': int, 'default': BATCH_SIZE}),
+        ('--pause', {'type': float, 'default': 0.05, 'help': 'seconds to yield the write lock between chunks'}),
+    ],
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Library database maintenance')
+    parser.add_argument('--db', default='library.db', help='database file (default: library.db)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, func in COMMANDS.items():
+        command = sub.add_parser(name, help=func.__doc__)
+        for flag, options in OPTIONS.get(name, ()):
+            command.add_argument(flag, **options)
+    args = parser.parse_args(argv)
+
+    library = Library(db_name=args.db)
+    library.db.create_tables()
+    start = time.perf_counter()
+    try:
+        result = COMMANDS[args.command](library, args)
+    finally:
+        library.close()
+    result['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    print(json.dumps(result, indent=2, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
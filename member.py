@@ -1,11 +1,20 @@
 # member.py
+import re
 from database import Database
+from pagination import DEFAULT_PAGE_SIZE, keyset_page
 from datetime import datetime
 
+# 搜索结果默认上限
+SEARCH_LIMIT = 50
+SEARCH_COLUMNS = '''members.member_id, members.name, members.email, members.phone,
+                   DATE(members.join_date) as join_date, members.status,
+                   members.total_books_borrowed'''
+
 class Member:
-    def __init__(self):
-        self.db = Database()
-        self.db.get_connection()
+    def __init__(self, db=None):
+        self.db = db or Database()
+        self.db.get_pool()
+        self._fts_enabled = None
     
     def add_member(self, name, email, phone=None, membership_type='Regular'):
         """添加新会员"""
@@ -25,6 +34,21 @@ class Member:
         '''
         return self.db.fetch_all(query)
     
+    def get_members_page(self, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """分页获取会员（按 name, member_id 键集分页）"""
+        page = keyset_page(
+            self.db,
+            '''member_id, name, email, phone,
+               DATE(join_date) as join_date, status, total_books_borrowed''',
+            'members', ('name', 'member_id'), (1, 0), page_size, cursor)
+        page['total'] = self.count_members()
+        return page
+    
+    def count_members(self):
+        """获取会员总数（读取计数器表）"""
+        row = self.db.fetch_one('SELECT total_members FROM library_counters WHERE id = 1')
+        return row[0] if row else self.db.fetch_one('SELECT COUNT(*) FROM members')[0]
+    
     def get_member_by_id(self, member_id):
         """根据ID获取会员"""
         query = '''
@@ -35,47 +59,77 @@ class Member:
         '''
         return self.db.fetch_one(query, (member_id,))
     
-    def search_members(self, search_term, search_type='all'):
-        """搜索会员"""
+    def search_members(self, search_term, search_type='all', limit=SEARCH_LIMIT):
+        """搜索会员（按匹配程度排序）"""
         if not search_term:
             return self.get_all_members()
         
-        search_term = f"%{search_term}%"
+        term = search_term.strip()
+        email = term.lower()
+        phone = re.sub(r'\D', '', term)
         
-        if search_type == 'name':
-            query = '''
-                SELECT member_id, name, email, phone, DATE(join_date), status
-                FROM members
-                WHERE name LIKE ?
-                ORDER BY name
-            '''
-            params = (search_term,)
-        elif search_type == 'email':
-            query = '''
-                SELECT member_id, name, email, phone, DATE(join_date), status
-                FROM members
-                WHERE email LIKE ?
-                ORDER BY name
-            '''
-            params = (search_term,)
-        elif search_type == 'phone':
-            query = '''
-                SELECT member_id, name, email, phone, DATE(join_date), status
-                FROM members
-                WHERE phone LIKE ?
-                ORDER BY name
-            '''
-            params = (search_term,)
-        else:  # all
-            query = '''
-                SELECT member_id, name, email, phone, DATE(join_date), status
-                FROM members
-                WHERE name LIKE ? OR email LIKE ? OR phone LIKE ?
-                ORDER BY name
-            '''
-            params = (search_term, search_term, search_term)
+        # 按优先级依次查询：邮箱精确 > 邮箱前缀 > 电话前缀 > 姓名
+        lookups = []
+        if search_type in ('all', 'email'):
+            lookups.append(('email_norm = ?', (email,)))
+            lookups.append(('email_norm >= ? AND email_norm < ?', (email, email + '\uffff')))
+        if search_type in ('all', 'phone') and phone:
+            lookups.append(('phone_norm >= ? AND phone_norm < ?', (phone, phone + '\uffff')))
         
-        return self.db.fetch_all(query, params)
+        results = []
+        seen = set()
+        for where, params in lookups:
+            self._merge(results, seen, self._lookup(where, params, limit), limit)
+            if len(results) >= limit:
+                return results
+        if search_type in ('all', 'name'):
+            self._merge(results, seen, self._search_name(term, limit), limit)
+        return results
+    
+    def _lookup(self, where, params, limit):
+        """通过规范化列的索引查找会员"""
+        query = f'''
+            SELECT {SEARCH_COLUMNS}
+            FROM members
+            WHERE {where}
+            ORDER BY name
+            LIMIT ?
+        '''
+        return self.db.fetch_all(query, params + (limit,))
+    
+    def _search_name(self, term, limit):
+        """姓名模糊搜索：trigram 全文索引，不可用时退回 LIKE"""
+        # trigram 至少需要 3 个字符
+        if len(term) >= 3 and self._has_fts():
+            query = f'''
+                SELECT {SEARCH_COLUMNS}
+                FROM members_fts
+                JOIN members ON members.member_id = members_fts.rowid
+                WHERE members_fts MATCH ?
+                ORDER BY bm25(members_fts), members.name
+                LIMIT ?
+            '''
+            phrase = '"' + term.replace('"', '""') + '"'
+            return self.db.fetch_all(query, (phrase, limit))
+        return self._lookup('name LIKE ?', (f"%{term}%",), limit)
+    
+    def _has_fts(self):
+        """检查姓名全文索引是否可用"""
+        if self._fts_enabled is None:
+            row = self.db.fetch_one(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'members_fts'")
+            self._fts_enabled = row is not None
+        return self._fts_enabled
+    
+    @staticmethod
+    def _merge(results, seen, rows, limit):
+        """合并结果并去重，保持排序"""
+        for row in rows:
+            if len(results) >= limit:
+                break
+            if row[0] not in seen:
+                seen.add(row[0])
+                results.append(row)
     
     def update_member(self, member_id, name, email, phone, status):
         """更新会员信息"""
@@ -0,0 +1,709 @@
+# migrations.py
+"""Versioned schema migrations.
+
+Each entry in ``MIGRATIONS`` is ``(version, description, steps)`` where
+``steps`` is a list of SQL statements or callables taking a connection.
+Steps must be idempotent (``IF NOT EXISTS`` etc.) so a migration that was
+interrupted half-way can simply be re-run.
+"""
+import sqlite3
+import time
+
+
+def fts5_available(conn, tokenize=None):
+    """Check whether this SQLite build ships FTS5 (and the given tokenizer)"""
+    options = f", tokenize='{tokenize}'" if tokenize else ''
+    try:
+        conn.execute(f'CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x{options})')
+        conn.execute('DROP TABLE temp.fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def column_exists(conn, table, column):
+    """Check whether ``table`` already has ``column``"""
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_xinfo({table})'))
+
+
+def _create_books_fts(conn):
+    """Full-text catalog index over books, kept in sync by triggers"""
+    if not fts5_available(conn):
+        # Book.search_books falls back to LIKE when books_fts is missing
+        return
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, isbn, category,
+            content='books', content_rowid='book_id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author, isbn, category)
+            VALUES (new.book_id, new.title, new.author, new.isbn, new.category);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, isbn, category)
+            VALUES ('delete', old.book_id, old.title, old.author, old.isbn, old.category);
+        END
+    ''')
+    # Copy-count changes on every issue/return must not churn the index
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_au
+        AFTER UPDATE OF title, author, isbn, category ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, isbn, category)
+            VALUES ('delete', old.book_id, old.title, old.author, old.isbn, old.category);
+            INSERT INTO books_fts (rowid, title, author, isbn, category)
+            VALUES (new.book_id, new.title, new.author, new.isbn, new.category);
+        END
+    ''')
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+
+# Digits-only phone number, used for the phone_norm shadow column
+PHONE_DIGITS_SQL = (
+    "replace(replace(replace(replace(replace(replace("
+    "phone, ' ', ''), '-', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+)
+
+
+def _add_member_lookup_columns(conn):
+    """Normalized email/phone shadow columns with B-tree indexes"""
+    if not column_exists(conn, 'members', 'email_norm'):
+        conn.execute('''
+            ALTER TABLE members ADD COLUMN email_norm TEXT
+            GENERATED ALWAYS AS (lower(trim(email))) VIRTUAL
+        ''')
+    if not column_exists(conn, 'members', 'phone_norm'):
+        conn.execute(f'''
+            ALTER TABLE members ADD COLUMN phone_norm TEXT
+            GENERATED ALWAYS AS ({PHONE_DIGITS_SQL}) VIRTUAL
+        ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_members_email_norm ON members (email_norm)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_members_phone_norm ON members (phone_norm)')
+
+
+def _create_members_fts(conn):
+    """Trigram index over member names for substring/fuzzy lookup"""
+    if not fts5_available(conn, 'trigram'):
+        # Member.search_members falls back to LIKE when members_fts is missing
+        return
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5(
+            name, content='members', content_rowid='member_id',
+            tokenize='trigram'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS members_fts_ai AFTER INSERT ON members BEGIN
+            INSERT INTO members_fts (rowid, name) VALUES (new.member_id, new.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS members_fts_ad AFTER DELETE ON members BEGIN
+            INSERT INTO members_fts (members_fts, rowid, name)
+            VALUES ('delete', old.member_id, old.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS members_fts_au AFTER UPDATE OF name ON members BEGIN
+            INSERT INTO members_fts (members_fts, rowid, name)
+            VALUES ('delete', old.member_id, old.name);
+            INSERT INTO members_fts (rowid, name) VALUES (new.member_id, new.name);
+        END
+    ''')
+    conn.execute("INSERT INTO members_fts (members_fts) VALUES ('rebuild')")
+
+# Dashboard counters recomputed from the base tables (seed + reconciliation)
+COUNTER_COLUMNS = ('total_books', 'total_copies', 'available_copies', 'total_members',
+                   'active_members', 'active_loans', 'fines_due')
+COUNTERS_FROM_BASE_SQL = '''
+    SELECT
+        (SELECT COUNT(*) FROM books),
+        (SELECT COALESCE(SUM(total_copies), 0) FROM books),
+        (SELECT COALESCE(SUM(available_copies), 0) FROM books),
+        (SELECT COUNT(*) FROM members),
+        (SELECT COUNT(*) FROM members WHERE status = 'Active'),
+        (SELECT COUNT(*) FROM transactions WHERE return_date IS NULL),
+        (SELECT COALESCE(SUM(fine_amount), 0.0) FROM transactions WHERE fine_paid = FALSE)
+'''
+
+# Unpaid fine contributed by one transactions row (NEW or OLD)
+_UNPAID = "CASE WHEN {row}.fine_paid = FALSE THEN COALESCE({row}.fine_amount, 0) ELSE 0 END"
+
+COUNTER_TRIGGERS = [
+    '''
+        CREATE TRIGGER IF NOT EXISTS counters_books_ai AFTER INSERT ON books BEGIN
+            UPDATE library_counters
+            SET total_books = total_books + 1,
+                total_copies = total_copies + new.total_copies,
+                available_copies = available_copies + new.available_copies
+            WHERE id = 1;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS counters_books_ad AFTER DELETE ON books BEGIN
+            UPDATE library_counters
+            SET total_books = total_books - 1,
+                total_copies = total_copies - old.total_copies,
+                available_copies = available_copies - old.available_copies
+            WHERE id = 1;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS counters_books_au
+        AFTER UPDATE OF total_copies, available_copies ON books BEGIN
+            UPDATE library_counters
+            SET total_copies = total_copies + new.total_copies - old.total_copies,
+                available_copies = available_copies + new.available_copies - old.available_copies
+            WHERE id = 1;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS counters_members_ai AFTER INSERT ON members BEGIN
+            UPDATE library_counters
+            SET total_members = total_members + 1,
+                active_members = active_members + (new.status = 'Active')
+            WHERE id = 1;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS counters_members_ad AFTER DELETE ON members BEGIN
+            UPDATE library_counters
+            SET total_members = total_members - 1,
+                active_members = active_members - (old.status = 'Active')
+            WHERE id = 1;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS counters_members_au AFTER UPDATE OF status ON members BEGIN
+            UPDATE library_counters
+            SET active_members = active_members + (new.status = 'Active') - (old.status = 'Active')
+            WHERE id = 1;
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS counters_transactions_ai AFTER INSERT ON transactions BEGIN
+            UPDATE library_counters
+            SET active_loans = active_loans + (new.return_date IS NULL),
+                fines_due = fines_due + {_UNPAID.format(row='new')}
+            WHERE id = 1;
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS counters_transactions_ad AFTER DELETE ON transactions BEGIN
+            UPDATE library_counters
+            SET active_loans = active_loans - (old.return_date IS NULL),
+                fines_due = fines_due - {_UNPAID.format(row='old')}
+            WHERE id = 1;
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS counters_transactions_au
+        AFTER UPDATE OF return_date, fine_amount, fine_paid ON transactions BEGIN
+            UPDATE library_counters
+            SET active_loans = active_loans + (new.return_date IS NULL) - (old.return_date IS NULL),
+                fines_due = fines_due + {_UNPAID.format(row='new')} - {_UNPAID.format(row='old')}
+            WHERE id = 1;
+        END
+    ''',
+]
+
+
+def _create_library_counters(conn):
+    """Single-row counters table for the dashboard, seeded from base tables"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS library_counters (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_books INTEGER NOT NULL DEFAULT 0,
+            total_copies INTEGER NOT NULL DEFAULT 0,
+            available_copies INTEGER NOT NULL DEFAULT 0,
+            total_members INTEGER NOT NULL DEFAULT 0,
+            active_members INTEGER NOT NULL DEFAULT 0,
+            active_loans INTEGER NOT NULL DEFAULT 0,
+            fines_due REAL NOT NULL DEFAULT 0.0
+        )
+    ''')
+    values = conn.execute(COUNTERS_FROM_BASE_SQL).fetchone()
+    conn.execute(f'''
+        INSERT OR REPLACE INTO library_counters (id, {', '.join(COUNTER_COLUMNS)})
+        VALUES (1, {', '.join('?' * len(COUNTER_COLUMNS))})
+    ''', values)
+    for trigger in COUNTER_TRIGGERS:
+        conn.execute(trigger)
+
+def _create_settings_revision(conn):
+    """Revision counter bumped on every settings change, for cheap cache checks"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO settings_revision (id, revision) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS settings_revision_{event.lower()}
+            AFTER {event} ON settings BEGIN
+                UPDATE settings_revision SET revision = revision + 1 WHERE id = 1;
+            END
+        ''')
+
+# Canonical ISBN (no hyphens/spaces, upper-case check digit)
+ISBN_NORM_SQL = "upper(replace(replace(isbn, '-', ''), ' ', ''))"
+
+
+def _add_isbn_norm(conn):
+    """Normalized ISBN shadow column so imports can merge on it"""
+    if not column_exists(conn, 'books', 'isbn_norm'):
+        conn.execute(f'''
+            ALTER TABLE books ADD COLUMN isbn_norm TEXT
+            GENERATED ALWAYS AS ({ISBN_NORM_SQL}) VIRTUAL
+        ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_isbn_norm ON books (isbn_norm)')
+
+# Tables whose writes invalidate cached UI query results
+VERSIONED_TABLES = ('books', 'members', 'transactions', 'settings')
+
+
+def _create_table_versions(conn):
+    """Per-table version numbers bumped by triggers on every write"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for table in VERSIONED_TABLES:
+        conn.execute('INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)',
+                     (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS version_{table}_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    UPDATE table_versions SET version = version + 1
+                    WHERE table_name = '{table}';
+                END
+            ''')
+
+# Borrow-count rollups for the popular-books and top-readers reports. They
+# count issues over all history, so rows are only ever added by triggers.
+POPULARITY_REBUILD_SQL = [
+    'DELETE FROM book_borrow_counts',
+    'DELETE FROM book_borrow_periods',
+    'DELETE FROM member_borrow_counts',
+    '''
+        INSERT INTO book_borrow_counts (book_id, borrow_count)
+        SELECT book_id, COUNT(*) FROM transactions GROUP BY book_id
+    ''',
+    '''
+        INSERT INTO book_borrow_periods (period, book_id, borrow_count)
+        SELECT strftime('%Y-%m', issue_date), book_id, COUNT(*)
+        FROM transactions
+        WHERE issue_date IS NOT NULL
+        GROUP BY 1, 2
+    ''',
+    '''
+        INSERT INTO member_borrow_counts (member_id, borrow_count, last_borrowed)
+        SELECT member_id, COUNT(*), MAX(issue_date) FROM transactions GROUP BY member_id
+    ''',
+]
+
+
+def _create_popularity_rollups(conn):
+    """Per-book (overall and monthly) and per-member borrow counts"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS book_borrow_counts (
+            book_id INTEGER PRIMARY KEY,
+            borrow_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_book_borrow_counts_count
+        ON book_borrow_counts (borrow_count DESC, book_id)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS book_borrow_periods (
+            period TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            borrow_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, book_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_book_borrow_periods_count
+        ON book_borrow_periods (period, borrow_count DESC)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS member_borrow_counts (
+            member_id INTEGER PRIMARY KEY,
+            borrow_count INTEGER NOT NULL DEFAULT 0,
+            last_borrowed TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_member_borrow_counts_count
+        ON member_borrow_counts (borrow_count DESC, member_id)
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS popularity_transactions_ai AFTER INSERT ON transactions BEGIN
+            INSERT INTO book_borrow_counts (book_id, borrow_count) VALUES (new.book_id, 1)
+            ON CONFLICT (book_id) DO UPDATE SET borrow_count = borrow_count + 1;
+            INSERT INTO book_borrow_periods (period, book_id, borrow_count)
+            VALUES (strftime('%Y-%m', new.issue_date), new.book_id, 1)
+            ON CONFLICT (period, book_id) DO UPDATE SET borrow_count = borrow_count + 1;
+            INSERT INTO member_borrow_counts (member_id, borrow_count, last_borrowed)
+            VALUES (new.member_id, 1, new.issue_date)
+            ON CONFLICT (member_id) DO UPDATE SET
+                borrow_count = borrow_count + 1,
+                last_borrowed = MAX(COALESCE(last_borrowed, excluded.last_borrowed),
+                                    excluded.last_borrowed);
+        END
+    ''')
+    for statement in POPULARITY_REBUILD_SQL:
+        conn.execute(statement)
+
+def _create_activity_rollup(conn):
+    """Daily activity facts keyed on issue day, refreshed incrementally"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            day TEXT PRIMARY KEY,
+            issues INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            open_loans INTEGER NOT NULL DEFAULT 0,
+            fines_accrued REAL NOT NULL DEFAULT 0.0,
+            fines_paid REAL NOT NULL DEFAULT 0.0
+        ) WITHOUT ROWID
+    ''')
+    # Issue days whose loans were returned/fined since the last refresh
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS activity_dirty_days (
+            day TEXT PRIMARY KEY
+        ) WITHOUT ROWID
+    ''')
+    # High-water marks for incremental jobs
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("INSERT OR IGNORE INTO rollup_state (name, value) VALUES ('activity_last_transaction_id', 0)")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS activity_transactions_au
+        AFTER UPDATE OF return_date, fine_amount, fine_paid ON transactions BEGIN
+            INSERT OR IGNORE INTO activity_dirty_days (day) VALUES (date(new.issue_date));
+        END
+    ''')
+
+
+# Loan timestamps (issue/due/return) are Unix epoch seconds since migration
+# 13; rollup keys and displays use the local calendar. The migrations above
+# ran against local-time text and are left as they shipped.
+EPOCH_DATE_SQL = "date({column}, 'unixepoch', 'localtime')"
+EPOCH_MONTH_SQL = "strftime('%Y-%m', {column}, 'unixepoch', 'localtime')"
+
+
+def local_date_sql(column):
+    """SQL for the local 'YYYY-MM-DD' of an epoch-seconds column"""
+    return EPOCH_DATE_SQL.format(column=column)
+
+
+def local_month_sql(column):
+    """SQL for the local 'YYYY-MM' of an epoch-seconds column"""
+    return EPOCH_MONTH_SQL.format(column=column)
+
+
+def day_start_sql(day, offset=None):
+    """SQL for the epoch seconds of local midnight on ``day`` (plus an optional modifier)"""
+    modifier = f", '{offset}'" if offset else ''
+    return f"unixepoch({day}{modifier}, 'utc')"
+
+
+# Rebuild of the borrow-count rollups from current data, for
+# Report.rebuild_popularity; {source} is transactions or all_transactions
+POPULARITY_REBUILD_TEMPLATE = [
+    'DELETE FROM book_borrow_counts',
+    'DELETE FROM book_borrow_periods',
+    'DELETE FROM member_borrow_counts',
+    '''
+        INSERT INTO book_borrow_counts (book_id, borrow_count)
+        SELECT book_id, COUNT(*) FROM {source} GROUP BY book_id
+    ''',
+    f'''
+        INSERT INTO book_borrow_periods (period, book_id, borrow_count)
+        SELECT {local_month_sql('issue_date')}, book_id, COUNT(*)
+        FROM {{source}}
+        WHERE issue_date IS NOT NULL
+        GROUP BY 1, 2
+    ''',
+    '''
+        INSERT INTO member_borrow_counts (member_id, borrow_count, last_borrowed)
+        SELECT member_id, COUNT(*), MAX(issue_date) FROM {source} GROUP BY member_id
+    ''',
+]
+
+
+def popularity_rebuild_sql(source='transactions'):
+    """Rollup rebuild statements reading loans from ``source``"""
+    return [statement.format(source=source) for statement in POPULARITY_REBUILD_TEMPLATE]
+
+
+def _text_to_epoch_sql(column):
+    # Text timestamps were written in local time
+    return (f"CASE WHEN typeof({column}) = 'text' "
+            f"THEN COALESCE(unixepoch({column}, 'utc'), {column}) ELSE {column} END")
+
+
+def _rebuild_transactions(conn):
+    """Recreate main.transactions with INTEGER epoch columns, converting text timestamps"""
+    declared = {row[1]: row[2] for row in conn.execute('PRAGMA main.table_info(transactions)')}
+    if declared.get('issue_date', '').upper() == 'INTEGER':
+        return
+    dependents = conn.execute('''
+        SELECT sql FROM main.sqlite_master
+        WHERE tbl_name = 'transactions' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ORDER BY type, name
+    ''').fetchall()
+    sequence = conn.execute("SELECT seq FROM main.sqlite_sequence WHERE name = 'transactions'").fetchone()
+    # Same definition as Database._create_tables
+    conn.execute('''
+        CREATE TABLE main.transactions_new (
+            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            issue_date INTEGER DEFAULT (unixepoch()),
+            due_date INTEGER,
+            return_date INTEGER,
+            fine_amount REAL DEFAULT 0.0,
+            fine_paid BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (book_id) REFERENCES books (book_id),
+            FOREIGN KEY (member_id) REFERENCES members (member_id)
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO main.transactions_new
+            (transaction_id, book_id, member_id, issue_date, due_date, return_date,
+             fine_amount, fine_paid)
+        SELECT transaction_id, book_id, member_id, {_text_to_epoch_sql('issue_date')},
+               {_text_to_epoch_sql('due_date')}, {_text_to_epoch_sql('return_date')},
+               fine_amount, fine_paid
+        FROM main.transactions
+    ''')
+    conn.execute('DROP TABLE main.transactions')
+    # Legacy rename: nothing else needs rewriting, and the temp history view
+    # must not be re-checked while main.transactions is missing
+    legacy = conn.execute('PRAGMA legacy_alter_table').fetchone()[0]
+    conn.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        conn.execute('ALTER TABLE main.transactions_new RENAME TO transactions')
+    finally:
+        conn.execute(f'PRAGMA legacy_alter_table = {int(legacy)}')
+    if sequence:
+        conn.execute("UPDATE main.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transactions'",
+                     sequence)
+    for (sql,) in dependents:
+        conn.execute(sql)
+    # The copy fired no triggers; cached loan results must still go stale
+    conn.execute("UPDATE table_versions SET version = version + 1 WHERE table_name = 'transactions'")
+
+
+def _epoch_loan_timestamps(conn):
+    """Store loan timestamps as epoch seconds and switch the rollup triggers"""
+    conn.execute('DROP TRIGGER IF EXISTS popularity_transactions_ai')
+    conn.execute('DROP TRIGGER IF EXISTS activity_transactions_au')
+    # Upgraded files still declare TIMESTAMP columns defaulting to UTC text
+    _rebuild_transactions(conn)
+    schemas = ['main']
+    # The archive file is attached when the connection opens, if it exists
+    if any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list')) and conn.execute(
+            "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'transactions'").fetchone():
+        schemas.append('archive')
+    for schema in schemas:
+        conn.execute(f'''
+            UPDATE {schema}.transactions
+            SET issue_date = {_text_to_epoch_sql('issue_date')},
+                due_date = {_text_to_epoch_sql('due_date')},
+                return_date = {_text_to_epoch_sql('return_date')}
+            WHERE typeof(issue_date) = 'text' OR typeof(due_date) = 'text'
+               OR typeof(return_date) = 'text'
+        ''')
+    conn.execute(f'''
+        UPDATE member_borrow_counts SET last_borrowed = {_text_to_epoch_sql('last_borrowed')}
+        WHERE typeof(last_borrowed) = 'text'
+    ''')
+    # Period and day keys are unchanged, so the rollups stay valid
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS popularity_transactions_ai AFTER INSERT ON transactions BEGIN
+            INSERT INTO book_borrow_counts (book_id, borrow_count) VALUES (new.book_id, 1)
+            ON CONFLICT (book_id) DO UPDATE SET borrow_count = borrow_count + 1;
+            INSERT INTO book_borrow_periods (period, book_id, borrow_count)
+            VALUES (strftime('%Y-%m', new.issue_date, 'unixepoch', 'localtime'), new.book_id, 1)
+            ON CONFLICT (period, book_id) DO UPDATE SET borrow_count = borrow_count + 1;
+            INSERT INTO member_borrow_counts (member_id, borrow_count, last_borrowed)
+            VALUES (new.member_id, 1, new.issue_date)
+            ON CONFLICT (member_id) DO UPDATE SET
+                borrow_count = borrow_count + 1,
+                last_borrowed = MAX(COALESCE(last_borrowed, excluded.last_borrowed),
+                                    excluded.last_borrowed);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS activity_transactions_au
+        AFTER UPDATE OF return_date, fine_amount, fine_paid ON transactions BEGIN
+            INSERT OR IGNORE INTO activity_dirty_days (day)
+            VALUES (date(new.issue_date, 'unixepoch', 'localtime'));
+        END
+    ''')
+
+
+def _rename_activity_columns(conn):
+    """Name the activity_daily columns for what they count"""
+    # Rows are keyed on issue day and describe the loans issued that day, so
+    # 'returns'/'fines_paid' read like events on that day when they are not
+    for old, new in (('returns', 'returned_loans'), ('fines_paid', 'paid_fines')):
+        if column_exists(conn, 'activity_daily', old):
+            conn.execute(f'ALTER TABLE activity_daily RENAME COLUMN {old} TO {new}')
+
+MIGRATIONS = [
+    (1, 'Partial indexes for open loans', [
+        # Transaction.issue_book / Member.delete_member loan-limit checks
+        '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_open_member
+            ON transactions (member_id) WHERE return_date IS NULL
+        ''',
+        # Book.delete_book open-loan check
+        '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_open_book
+            ON transactions (book_id) WHERE return_date IS NULL
+        ''',
+        # Overdue report and dashboard overdue count
+        '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_open_due
+            ON transactions (due_date) WHERE return_date IS NULL
+        ''',
+    ]),
+    (2, 'History indexes for reports', [
+        # Covers Report.get_monthly_activity without touching the table
+        '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_issue_date
+            ON transactions (issue_date, return_date, fine_amount, fine_paid)
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_member_issue
+            ON transactions (member_id, issue_date)
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_book
+            ON transactions (book_id)
+        ''',
+    ]),
+    (3, 'FTS5 catalog index for book search', [
+        _create_books_fts,
+    ]),
+    (4, 'Normalized member lookup columns and trigram name index', [
+        _add_member_lookup_columns,
+        _create_members_fts,
+    ]),
+    (5, 'Trigger-maintained dashboard counters', [
+        _create_library_counters,
+    ]),
+    (6, 'Settings revision counter', [
+        _create_settings_revision,
+    ]),
+    (7, 'Normalized ISBN column for bulk catalog import', [
+        _add_isbn_norm,
+    ]),
+    (8, 'Sort indexes for keyset pagination', [
+        'CREATE INDEX IF NOT EXISTS idx_books_title ON books (title, book_id)',
+        'CREATE INDEX IF NOT EXISTS idx_members_name ON members (name, member_id)',
+    ]),
+    (9, 'Per-table version counters for the query cache', [
+        _create_table_versions,
+    ]),
+    (10, 'Borrow-count rollups for popularity reports', [
+        _create_popularity_rollups,
+    ]),
+    (11, 'Daily activity rollup for monthly reports', [
+        _create_activity_rollup,
+    ]),
+    (12, 'Fine accrual job run log', [
+        '''
+            CREATE TABLE IF NOT EXISTS fine_accrual_runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                status TEXT NOT NULL DEFAULT 'running',
+                last_transaction_id INTEGER NOT NULL DEFAULT 0,
+                loans_examined INTEGER NOT NULL DEFAULT 0,
+                loans_updated INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                duration_ms REAL
+            )
+        ''',
+    ]),
+    (13, 'Epoch-second loan timestamps', [
+        _epoch_loan_timestamps,
+    ]),
+    (14, 'Name activity rollup columns after the issue-day cohort', [
+        _rename_activity_columns,
+    ]),
+]
+
+
+def ensure_version_table(conn):
+    """Create the schema_version bookkeeping table"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            duration_ms REAL
+        )
+    ''')
+
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for a fresh file)"""
+    ensure_version_table(conn)
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations in order, one transaction each.
+
+    Returns the list of versions that were applied.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    version = current_version(conn)
+    conn.commit()
+    for number, description, steps in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        start = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('''
+                INSERT OR REPLACE INTO schema_version (version, description, duration_ms)
+                VALUES (?, ?, ?)
+            ''', (number, description, (time.perf_counter() - start) * 1000))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(number)
+    if applied:
+        conn.execute('PRAGMA optimize')
+    return applied
@@ -0,0 +1,74 @@
+# pagination.py
+"""Keyset (seek) pagination helpers.
+
+A page is fetched with ``WHERE (sort_key, id) > (?, ?)`` on an index
+instead of ``OFFSET``, so every page costs the same no matter how deep the
+user scrolls. Cursors are opaque URL-safe tokens carrying the direction
+and the boundary key.
+"""
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def encode_cursor(direction, key):
+    """Pack a direction ('next'/'prev') and a key tuple into a token"""
+    raw = json.dumps([direction, list(key)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """Unpack a cursor token into ``(direction, key)``"""
+    try:
+        direction, key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid page cursor: {e}')
+    if direction not in ('next', 'prev'):
+        raise ValueError(f"Invalid page cursor direction '{direction}'")
+    return direction, tuple(key)
+
+
+def keyset_page(db, columns, table, key_columns, key_indexes, page_size=DEFAULT_PAGE_SIZE,
+                cursor=None):
+    """Fetch one page ordered by ``key_columns``.
+
+    ``key_indexes`` gives the positions of the key columns within each
+    returned row, used to build the neighbouring cursors. Returns a dict
+    with ``rows``, ``next_cursor`` and ``prev_cursor`` (``None`` at either
+    end).
+    """
+    direction, key = decode_cursor(cursor) if cursor else ('next', None)
+    keys = ', '.join(key_columns)
+    placeholders = ', '.join('?' * len(key_columns))
+    if direction == 'next':
+        where = f'WHERE ({keys}) > ({placeholders})' if key else ''
+        order = ', '.join(key_columns)
+    else:
+        where = f'WHERE ({keys}) < ({placeholders})'
+        order = ', '.join(f'{column} DESC' for column in key_columns)
+    query = f'''
+        SELECT {columns}
+        FROM {table}
+        {where}
+        ORDER BY {order}
+        LIMIT ?
+    '''
+    rows = db.fetch_all(query, (key or ()) + (page_size + 1,))
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if direction == 'prev':
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = key is not None, has_more
+
+    def boundary(row):
+        return tuple(row[i] for i in key_indexes)
+
+    return {
+        'rows': rows,
+        'next_cursor': encode_cursor('next', boundary(rows[-1])) if rows and has_next else None,
+        'prev_cursor': encode_cursor('prev', boundary(rows[0])) if rows and has_prev else None,
+    }
@@ -0,0 +1,115 @@
+# query_cache.py
+"""Table-version-aware result cache for the Streamlit UI.
+
+Each cached call is keyed on the manager method and its arguments and
+remembers the version of every table it read (``table_versions``, bumped
+by triggers on each write). A hit is served only while those versions are
+unchanged, so results stay valid until the underlying data changes.
+Versions are read through the connection the method itself reads from (a
+report's ``reader``), so a result from an in-memory report copy is never
+stored under versions the copy hasn't caught up with yet. Entries are
+evicted least-recently-used once the memory budget is exceeded.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def estimate_size(value):
+    """Rough deep size of query results (lists/tuples/dicts of scalars)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class _Entry:
+    __slots__ = ('value', 'versions', 'size', 'stored_at')
+
+    def __init__(self, value, versions, size, stored_at):
+        self.value = value
+        self.versions = versions
+        self.size = size
+        self.stored_at = stored_at
+
+
+class QueryCache:
+    def __init__(self, db, max_bytes=DEFAULT_MAX_BYTES):
+        self.db = db
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def table_versions(self, tables, db=None):
+        """Current version of each table, in the given order"""
+        rows = dict((db or self.db).fetch_all('SELECT table_name, version FROM table_versions'))
+        return tuple(rows.get(table, 0) for table in tables)
+
+    def call(self, func, *args, tables=(), ttl=None, **kwargs):
+        """Return ``func(*args, **kwargs)``, cached until ``tables`` change.
+
+        ``ttl`` (seconds) additionally expires results that depend on the
+        clock, such as overdue counts.
+        """
+        key = (getattr(func, '__qualname__', repr(func)), args, tuple(sorted(kwargs.items())))
+        # Report methods read through their own (possibly snapshot) reader
+        source = getattr(getattr(func, '__self__', None), 'reader', None)
+        versions = self.table_versions(tables, source)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.versions == versions and (ttl is None or now - entry.stored_at < ttl):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+                self.stale += 1
+                self._drop(key)
+            self.misses += 1
+
+        value = func(*args, **kwargs)
+        entry = _Entry(value, versions, estimate_size(value), now)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self.bytes += entry.size
+                while self.bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return value
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Hit/miss and memory metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'stale': self.stale,
+                'evictions': self.evictions,
+            }
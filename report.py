@@ -1,60 +1,118 @@
 # report.py
-from database import Database
+import time
+from database import Database, DEFAULT_FETCH_SIZE, open_reader
+from migrations import (COUNTER_COLUMNS, COUNTERS_FROM_BASE_SQL, day_start_sql, local_date_sql,
+                        popularity_rebuild_sql)
+from settings import get_settings
+from transaction import accrued_fine_sql, fine_parameters
 from datetime import datetime, timedelta
 
+# 读取活动汇总前按需刷新的最短间隔（秒）
+ACTIVITY_REFRESH_INTERVAL = 60.0
+
+# 活动汇总的时间粒度
+ACTIVITY_PERIODS = {
+    'day': 'day',
+    'week': "strftime('%Y-W%W', day)",
+    'month': 'substr(day, 1, 7)',
+}
+
+# 报表查询，get_* 一次取回，iter_* 分块流式导出；{source} 为交易表或含归档的视图
+MEMBER_STATISTICS_SQL = '''
+    SELECT m.member_id, m.name, m.email,
+           COUNT(t.transaction_id) as total_borrowed,
+           SUM(CASE WHEN t.return_date IS NULL THEN 1 ELSE 0 END) as current_loans,
+           SUM(t.fine_amount) as total_fines,
+           SUM(CASE WHEN t.fine_paid = FALSE THEN t.fine_amount ELSE 0 END) as unpaid_fines
+    FROM members m
+    LEFT JOIN {source} t ON m.member_id = t.member_id
+    GROUP BY m.member_id
+    ORDER BY total_borrowed DESC
+'''
+
+OVERDUE_BOOKS_SQL = f'''
+    SELECT t.transaction_id, b.title, m.name, m.email,
+           date(t.issue_date, 'unixepoch', 'localtime') as issue_date,
+           date(t.due_date, 'unixepoch', 'localtime') as due_date,
+           (unixepoch() - t.due_date) / 86400.0 as days_overdue,
+           {accrued_fine_sql('t')} as fine_amount
+    FROM transactions t
+    JOIN books b ON t.book_id = b.book_id
+    JOIN members m ON t.member_id = m.member_id
+    WHERE t.return_date IS NULL 
+    AND t.due_date < unixepoch()
+    ORDER BY days_overdue DESC
+'''
+
 class Report:
-    def __init__(self):
-        self.db = Database()
-        self.db.get_connection()
+    def __init__(self, db=None, reader_mode=None, max_staleness=None,
+                 activity_refresh_interval=ACTIVITY_REFRESH_INTERVAL):
+        self.db = db or Database()
+        self.db.get_pool()
+        # 报表查询走只读连接（或内存副本），汇总表刷新等写操作仍走 self.db
+        self.reader = open_reader(self.db, reader_mode, max_staleness)
+        self.settings = get_settings(self.db)
+        # 为 None 时读取不触发刷新，由调用方（定时任务、写线程）负责
+        self.activity_refresh_interval = activity_refresh_interval
+        self._activity_refreshed_at = None
+    
+    def snapshot(self):
+        """在同一个一致快照中执行一组报表查询（上下文管理器）"""
+        return self.reader.snapshot()
+    
+    def staleness(self):
+        """报表数据相对数据库的滞后秒数"""
+        return self.reader.staleness()
     
     def get_library_statistics(self):
         """获取图书馆统计"""
-        stats = []
-        
-        # 总书籍数量
-        query = "SELECT COUNT(*) FROM books"
-        total_books = self.db.fetch_one(query)[0]
-        stats.append(("Total Books", total_books))
-        
-        # 总副本数量
-        query = "SELECT SUM(total_copies) FROM books"
-        total_copies = self.db.fetch_one(query)[0] or 0
-        stats.append(("Total Copies", total_copies))
-        
-        # 可用副本数量
-        query = "SELECT SUM(available_copies) FROM books"
-        available_copies = self.db.fetch_one(query)[0] or 0
-        stats.append(("Available Copies", available_copies))
+        # 计数器表由触发器维护，一次读取即可
+        query = f"SELECT {', '.join(COUNTER_COLUMNS)} FROM library_counters WHERE id = 1"
+        with self.snapshot():
+            counters = self.reader.fetch_one(query)
+            if not counters:
+                counters = self.reader.fetch_one(COUNTERS_FROM_BASE_SQL)
+            overdue = self.get_overdue_count()
+        (total_books, total_copies, available_copies, total_members,
+         active_members, active_loans, total_fines) = counters
         
-        # 总会员数量
-        query = "SELECT COUNT(*) FROM members"
-        total_members = self.db.fetch_one(query)[0]
-        stats.append(("Total Members", total_members))
-        
-        # 活跃会员数量
-        query = "SELECT COUNT(*) FROM members WHERE status = 'Active'"
-        active_members = self.db.fetch_one(query)[0]
-        stats.append(("Active Members", active_members))
-        
-        # 活跃借阅数量
-        query = "SELECT COUNT(*) FROM transactions WHERE return_date IS NULL"
-        active_loans = self.db.fetch_one(query)[0]
-        stats.append(("Active Loans", active_loans))
-        
-        # 逾期书籍数量
+        stats = [
+            ("Total Books", total_books),
+            ("Total Copies", total_copies),
+            ("Available Copies", available_copies),
+            ("Total Members", total_members),
+            ("Active Members", active_members),
+            ("Active Loans", active_loans),
+            ("Overdue Books", overdue),
+            ("Total Fines Due", f"${total_fines:.2f}"),
+        ]
+        return stats
+    
+    def get_overdue_count(self):
+        """获取逾期数量（随时间变化，走 due_date 部分索引）"""
         query = '''
             SELECT COUNT(*) FROM transactions 
-            WHERE return_date IS NULL AND due_date < datetime('now')
+            WHERE return_date IS NULL AND due_date < unixepoch()
         '''
-        overdue_books = self.db.fetch_one(query)[0]
-        stats.append(("Overdue Books", overdue_books))
-        
-        # 总罚款
-        query = "SELECT SUM(fine_amount) FROM transactions WHERE fine_paid = FALSE"
-        total_fines = self.db.fetch_one(query)[0] or 0.0
-        stats.append(("Total Fines Due", f"${total_fines:.2f}"))
+        return self.reader.fetch_one(query)[0]
+    
+    def reconcile_counters(self):
+        """根据基础表重建计数器，返回偏差"""
+        with self.db.transaction() as conn:
+            actual = conn.execute(COUNTERS_FROM_BASE_SQL).fetchone()
+            stored = conn.execute(
+                f"SELECT {', '.join(COUNTER_COLUMNS)} FROM library_counters WHERE id = 1"
+            ).fetchone() or (0,) * len(COUNTER_COLUMNS)
+            conn.execute(f'''
+                INSERT OR REPLACE INTO library_counters (id, {', '.join(COUNTER_COLUMNS)})
+                VALUES (1, {', '.join('?' * len(COUNTER_COLUMNS))})
+            ''', actual)
         
-        return stats
+        drift = {}
+        for name, have, want in zip(COUNTER_COLUMNS, stored, actual):
+            if abs(have - want) > 1e-9:
+                drift[name] = {'stored': have, 'actual': want}
+        return drift
     
     def get_available_books(self):
         """获取可用书籍"""
@@ -64,20 +122,29 @@ class Report:
             WHERE available_copies > 0
             ORDER BY title
         '''
-        return self.db.fetch_all(query)
+        return self.reader.fetch_all(query)
     
-    def get_popular_books(self, limit=10):
-        """获取热门书籍"""
+    def get_popular_books(self, limit=10, period=None):
+        """获取热门书籍（读取借阅次数汇总表，period 为 'YYYY-MM'）"""
+        if period:
+            query = '''
+                SELECT b.book_id, b.title, b.author, c.borrow_count
+                FROM book_borrow_periods c
+                JOIN books b ON b.book_id = c.book_id
+                WHERE c.period = ?
+                ORDER BY c.borrow_count DESC
+                LIMIT ?
+            '''
+            return self.reader.fetch_all(query, (period, limit))
+        
         query = '''
-            SELECT b.book_id, b.title, b.author, 
-                   COUNT(t.transaction_id) as borrow_count
-            FROM books b
-            LEFT JOIN transactions t ON b.book_id = t.book_id
-            GROUP BY b.book_id
-            ORDER BY borrow_count DESC
+            SELECT b.book_id, b.title, b.author, c.borrow_count
+            FROM book_borrow_counts c
+            JOIN books b ON b.book_id = c.book_id
+            ORDER BY c.borrow_count DESC
             LIMIT ?
         '''
-        return self.db.fetch_all(query, (limit,))
+        return self.reader.fetch_all(query, (limit,))
     
     def get_books_by_category(self):
         """按分类统计书籍"""
@@ -89,55 +156,125 @@ class Report:
             GROUP BY category
             ORDER BY count DESC
         '''
-        return self.db.fetch_all(query)
+        return self.reader.fetch_all(query)
     
-    def get_member_statistics(self):
-        """获取会员统计"""
-        query = '''
-            SELECT m.member_id, m.name, m.email,
-                   COUNT(t.transaction_id) as total_borrowed,
-                   SUM(CASE WHEN t.return_date IS NULL THEN 1 ELSE 0 END) as current_loans,
-                   SUM(t.fine_amount) as total_fines,
-                   SUM(CASE WHEN t.fine_paid = FALSE THEN t.fine_amount ELSE 0 END) as unpaid_fines
-            FROM members m
-            LEFT JOIN transactions t ON m.member_id = t.member_id
-            GROUP BY m.member_id
-            ORDER BY total_borrowed DESC
-        '''
-        return self.db.fetch_all(query)
+    def get_member_statistics(self, include_archive=False):
+        """获取会员统计（include_archive 为真时包含归档历史）"""
+        with self.reader.get_connection() as conn:
+            source = self.reader.history_source(conn, include_archive)
+            return self.reader.fetch_all(MEMBER_STATISTICS_SQL.format(source=source))
+    
+    def iter_member_statistics(self, chunk_size=DEFAULT_FETCH_SIZE, include_archive=False):
+        """分块流式读取会员统计（用于导出）"""
+        with self.reader.get_connection() as conn:
+            source = self.reader.history_source(conn, include_archive)
+            yield from self.reader.iter_chunks(MEMBER_STATISTICS_SQL.format(source=source), (), chunk_size)
     
     def get_overdue_books(self):
-        """获取逾期书籍"""
-        query = '''
-            SELECT t.transaction_id, b.title, m.name, m.email,
-                   DATE(t.issue_date) as issue_date,
-                   DATE(t.due_date) as due_date,
-                   julianday('now') - julianday(t.due_date) as days_overdue,
-                   t.fine_amount
-            FROM transactions t
-            JOIN books b ON t.book_id = b.book_id
-            JOIN members m ON t.member_id = m.member_id
-            WHERE t.return_date IS NULL 
-            AND t.due_date < datetime('now')
-            ORDER BY days_overdue DESC
-        '''
-        return self.db.fetch_all(query)
+        """获取逾期书籍（罚款为当前应计金额）"""
+        return self.reader.fetch_all(OVERDUE_BOOKS_SQL, fine_parameters(self.settings))
+    
+    def iter_overdue_books(self, chunk_size=DEFAULT_FETCH_SIZE):
+        """分块流式读取逾期书籍（用于导出）"""
+        return self.reader.iter_chunks(OVERDUE_BOOKS_SQL, fine_parameters(self.settings), chunk_size)
     
     def get_monthly_activity(self, months=6):
-        """获取月度活动"""
-        query = '''
-            SELECT 
-                strftime('%Y-%m', issue_date) as month,
-                COUNT(*) as total_issues,
-                SUM(CASE WHEN return_date IS NULL THEN 1 ELSE 0 END) as active_loans,
-                SUM(fine_amount) as total_fines,
-                SUM(CASE WHEN fine_paid = TRUE THEN fine_amount ELSE 0 END) as paid_fines
-            FROM transactions
-            WHERE issue_date >= date('now', ?)
-            GROUP BY strftime('%Y-%m', issue_date)
-            ORDER BY month DESC
+        """获取月度活动（读取每日活动汇总表）"""
+        start = self.reader.fetch_one("SELECT date('now', 'localtime', ?)", (f'-{months} months',))[0]
+        rows = self.get_activity(start=start, granularity='month')
+        # month, total_issues, active_loans, total_fines, paid_fines
+        return [(period, issues, open_loans, fines_accrued, paid_fines)
+                for period, issues, returned_loans, open_loans, fines_accrued, paid_fines in rows]
+    
+    def get_activity(self, start=None, end=None, granularity='day'):
+        """按借出日期汇总活动，start/end 为 'YYYY-MM-DD'（含）。
+        
+        每行描述该时段借出的图书：借出数、其中已归还数、仍未归还数、罚款及其中已付罚款，
+        不是该时段内发生的归还或付款。只读，需要时按 refresh_activity_if_stale 刷新。
+        """
+        if granularity not in ACTIVITY_PERIODS:
+            raise ValueError(f"Unknown granularity '{granularity}' (use day, week or month)")
+        self.refresh_activity_if_stale()
+        
+        period = ACTIVITY_PERIODS[granularity]
+        query = f'''
+            SELECT {period} as period,
+                   SUM(issues), SUM(returned_loans), SUM(open_loans),
+                   SUM(fines_accrued), SUM(paid_fines)
+            FROM activity_daily
+            WHERE day >= ? AND day <= ?
+            GROUP BY period
+            ORDER BY period DESC
         '''
-        return self.db.fetch_all(query, (f'-{months} months',))
+        return self.reader.fetch_all(query, (start or '0000-01-01', end or '9999-12-31'))
+    
+    def activity_pending(self):
+        """活动汇总是否落后于交易表（有新交易或待刷新的日期）"""
+        row = self.reader.fetch_one('''
+            SELECT (SELECT value FROM rollup_state WHERE name = 'activity_last_transaction_id')
+                       < (SELECT COALESCE(MAX(transaction_id), 0) FROM transactions)
+                   OR EXISTS (SELECT 1 FROM activity_dirty_days)
+        ''')
+        return bool(row and row[0])
+    
+    def refresh_activity_if_stale(self, interval=None):
+        """读取前按需刷新活动汇总，返回刷新的天数。
+        
+        interval 默认取 activity_refresh_interval。只读库、内存副本读取（刷新后也看不到）、未到刷新间隔或没有待处理变动时跳过，
+        所以大多数报表读取不会占用写锁。
+        """
+        if interval is None:
+            interval = self.activity_refresh_interval
+        if interval is None or self.db.query_only() or self.reader.staleness() > 0:
+            return 0
+        refreshed_at = self._activity_refreshed_at
+        if refreshed_at is not None and time.monotonic() - refreshed_at < interval:
+            return 0
+        if not self.activity_pending():
+            return 0
+        return self.refresh_activity()
+    
+    def refresh_activity(self):
+        """增量刷新每日活动汇总：只处理新交易和有变动的日期"""
+        with self.db.transaction() as conn:
+            last_id = conn.execute(
+                "SELECT value FROM rollup_state WHERE name = 'activity_last_transaction_id'"
+            ).fetchone()[0]
+            max_id = conn.execute('SELECT COALESCE(MAX(transaction_id), 0) FROM transactions').fetchone()[0]
+            
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS refresh_days (day TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM refresh_days')
+            conn.execute(f'''
+                INSERT OR IGNORE INTO refresh_days (day)
+                SELECT {local_date_sql('issue_date')} FROM transactions
+                WHERE transaction_id > ? AND issue_date IS NOT NULL
+            ''', (last_id,))
+            conn.execute('INSERT OR IGNORE INTO refresh_days (day) SELECT day FROM activity_dirty_days')
+            
+            # 按 issue_date 覆盖索引逐日（本地日界）范围扫描重新计算
+            conn.execute(f'''
+                INSERT OR REPLACE INTO activity_daily
+                    (day, issues, returned_loans, open_loans, fines_accrued, paid_fines)
+                SELECT d.day,
+                       COUNT(*),
+                       SUM(t.return_date IS NOT NULL),
+                       SUM(t.return_date IS NULL),
+                       COALESCE(SUM(t.fine_amount), 0.0),
+                       COALESCE(SUM(CASE WHEN t.fine_paid = TRUE THEN t.fine_amount ELSE 0 END), 0.0)
+                FROM refresh_days d
+                JOIN transactions t
+                  ON t.issue_date >= {day_start_sql('d.day')}
+                 AND t.issue_date < {day_start_sql('d.day', '+1 day')}
+                GROUP BY d.day
+            ''')
+            refreshed = conn.execute('SELECT COUNT(*) FROM refresh_days').fetchone()[0]
+            
+            conn.execute('DELETE FROM activity_dirty_days')
+            conn.execute(
+                "UPDATE rollup_state SET value = ? WHERE name = 'activity_last_transaction_id'",
+                (max_id,))
+        self._activity_refreshed_at = time.monotonic()
+        return refreshed
     
     def get_category_distribution(self):
         """获取分类分布"""
@@ -147,19 +284,28 @@ class Report:
             GROUP BY category
             ORDER BY count DESC
         '''
-        return self.db.fetch_all(query)
+        return self.reader.fetch_all(query)
     
     def get_top_members(self, limit=10):
-        """获取顶级会员"""
+        """获取顶级会员（读取借阅次数汇总表）"""
         query = '''
             SELECT m.member_id, m.name, m.email,
-                   COUNT(t.transaction_id) as books_borrowed,
-                   MAX(t.issue_date) as last_borrowed
-            FROM members m
-            LEFT JOIN transactions t ON m.member_id = t.member_id
+                   c.borrow_count as books_borrowed,
+                   datetime(c.last_borrowed, 'unixepoch', 'localtime') as last_borrowed
+            FROM member_borrow_counts c
+            JOIN members m ON m.member_id = c.member_id
             WHERE m.status = 'Active'
-            GROUP BY m.member_id
-            ORDER BY books_borrowed DESC
+            ORDER BY c.borrow_count DESC
             LIMIT ?
         '''
-        return self.db.fetch_all(query, (limit,))
\ No newline at end of file
+        return self.reader.fetch_all(query, (limit,))
+    
+    def rebuild_popularity(self):
+        """根据交易记录重建借阅次数汇总表"""
+        # 汇总覆盖全部历史，包括已归档的交易
+        with self.db.get_connection() as conn:
+            source = self.db.history_source(conn, include_archive=True)
+            with self.db.transaction() as conn:
+                for statement in popularity_rebuild_sql(source):
+                    conn.execute(statement)
+        return True
\ No newline at end of file
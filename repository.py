@@ -0,0 +1,58 @@
+# repository.py
+"""The four managers over one shared ``Database``.
+
+    library = Library('library.db')
+    with library.unit_of_work():
+        library.member.update_member(member_id, name, email, phone, 'Active')
+        library.transaction.issue_many(member_id, book_ids)
+
+Every manager gets the same ``Database``, so a process holds one pool
+(and one page cache per pooled connection) instead of one per manager.
+``unit_of_work()`` wraps ``Database.transaction()``: manager writes made
+inside it join a single BEGIN IMMEDIATE ... COMMIT, so a desk action that
+touches several managers commits, and syncs the WAL, once. A manager call
+that fails inside the unit rolls back only its own savepoint and returns
+``False`` as usual; an exception that escapes the block rolls everything
+back. Caches fed by writes (such as the catalog index) are updated only
+after the outermost commit.
+
+Reports still read through their own read-only reader (see
+``open_reader``), so they don't see a unit's writes until it commits.
+"""
+from contextlib import contextmanager
+
+from book import Book
+from database import Database
+from member import Member
+from report import Report
+from transaction import Transaction
+
+
+class Library:
+    def __init__(self, db=None, **options):
+        """Use ``db``, or open a ``Database`` with ``options`` (db_name, pool_size, ...)"""
+        self.db = db or Database(**options)
+        self.book = Book(self.db)
+        self.member = Member(self.db)
+        self.transaction = Transaction(self.db)
+        self.report = Report(self.db)
+
+    def managers(self):
+        """Managers by name, as used for 'manager.method' operation names"""
+        return {
+            'book': self.book,
+            'member': self.member,
+            'transaction': self.transaction,
+            'report': self.report,
+        }
+
+    @contextmanager
+    def unit_of_work(self):
+        """Batch every manager write in the block into one transaction (yields self)"""
+        with self.db.transaction():
+            yield self
+
+    def close(self):
+        if self.report.reader is not self.db:
+            self.report.reader.close()
+        self.db.close()
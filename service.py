@@ -0,0 +1,310 @@
+# service.py
+"""Local asyncio circulation service shared by desk terminals and kiosks.
+
+    python service.py --db library.db --port 8765
+
+Speaks newline-delimited JSON over TCP on localhost. Each request line is
+
+    {"id": 1, "op": "book.search_books", "args": ["gatsby"], "kwargs": {}}
+
+and gets back ``{"id": 1, "ok": true, "result": ...}`` (or ``"error"``).
+Reads run concurrently on a bounded thread pool; every mutation goes
+through a single writer queue so SQLite sees one writer at a time. Writes
+queued together are committed together (one unit of work, each write in
+its own savepoint), so a burst from several desks costs one commit.
+Activity reports are reads: the rollup refresh they need is committed
+through the writer queue first, then the report is read on the pool.
+``service.stats`` returns per-operation latency histograms and the
+statements taking the most database time.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+from repository import Library
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_READ_WORKERS = 4
+DEFAULT_WRITE_QUEUE_SIZE = 1000
+# Queued writes committed together in one unit of work
+MAX_WRITE_BATCH = 64
+
+READ_OPS = {
+    'book': ('get_all_books', 'get_book_by_id', 'search_books', 'search_available',
+             'get_books_page', 'count_books', 'get_available_books'),
+    'member': ('get_all_members', 'get_member_by_id', 'search_members', 'get_members_page',
+               'count_members', 'get_active_members'),
+    'transaction': ('get_active_transactions', 'get_transaction_history',
+                    'get_member_transactions', 'calculate_fine', 'calculate_fines'),
+    'report': ('get_library_statistics', 'get_overdue_count', 'get_available_books',
+               'get_popular_books', 'get_books_by_category', 'get_member_statistics',
+               'get_overdue_books', 'get_category_distribution', 'get_top_members',
+               'get_monthly_activity', 'get_activity'),
+}
+
+WRITE_OPS = {
+    'book': ('add_book', 'update_book', 'delete_book', 'update_copies'),
+    'member': ('add_member', 'update_member', 'delete_member', 'update_books_borrowed'),
+    'transaction': ('issue_book', 'return_book', 'issue_many', 'return_many', 'pay_fine'),
+    # These refresh rollup tables before reading, so they take the write lock
+    'report': ('refresh_activity', 'reconcile_counters', 'rebuild_popularity'),
+}
+
+# Reads of the activity rollup; a stale rollup is refreshed (and committed)
+# through the writer queue before the read runs
+ACTIVITY_READS = frozenset({'report.get_monthly_activity', 'report.get_activity'})
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+
+
+class LatencyHistogram:
+    __slots__ = ('counts', 'total_ms', 'max_ms', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+
+    def record(self, elapsed_ms, ok=True):
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.counts[i] += 1
+                break
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if not ok:
+            self.errors += 1
+
+    def as_dict(self):
+        count = sum(self.counts)
+        return {
+            'count': count,
+            'errors': self.errors,
+            'mean_ms': round(self.total_ms / count, 3) if count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'buckets': {('inf' if bound == float('inf') else f'le_{bound}ms'): n
+                        for bound, n in zip(LATENCY_BUCKETS_MS, self.counts)},
+        }
+
+
+class ServiceError(Exception):
+    """Bad request sent to the service"""
+
+
+class LibraryService:
+    def __init__(self, db_name='library.db', read_workers=DEFAULT_READ_WORKERS,
+                 write_queue_size=DEFAULT_WRITE_QUEUE_SIZE):
+        # One pooled connection per reader plus one for the writer
+        self.db = Database(db_name, pool_size=read_workers + 1)
+        self.db.create_tables()
+        self.library = Library(self.db)
+        self.managers = self.library.managers()
+        # Reader threads never refresh the rollup themselves; the writer does
+        report = self.managers['report']
+        self.activity_refresh_interval = report.activity_refresh_interval
+        report.activity_refresh_interval = None
+        self.read_workers = read_workers
+        self.write_queue_size = write_queue_size
+        self._readers = ThreadPoolExecutor(read_workers, thread_name_prefix='library-read')
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='library-write')
+        self._write_queue = None
+        self._writer_task = None
+        self._server = None
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, op):
+        """Map 'manager.method' to a bound method and whether it writes"""
+        manager_name, _, method = op.partition('.')
+        if method in READ_OPS.get(manager_name, ()):
+            return getattr(self.managers[manager_name], method), False
+        if method in WRITE_OPS.get(manager_name, ()):
+            return getattr(self.managers[manager_name], method), True
+        raise ServiceError(f"Unknown operation '{op}'")
+
+    async def dispatch(self, op, args=(), kwargs=None):
+        """Run one operation on the reader pool or through the writer queue"""
+        if op == 'service.stats':
+            return self.stats()
+        func, writes = self.resolve(op)
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        ok = False
+        try:
+            if writes:
+                result = await self._submit_write(func, args, kwargs or {})
+            else:
+                if op in ACTIVITY_READS and self.activity_refresh_interval is not None:
+                    await self._submit_write(self.managers['report'].refresh_activity_if_stale,
+                                             (self.activity_refresh_interval,), {})
+                result = await loop.run_in_executor(
+                    self._readers, lambda: func(*args, **(kwargs or {})))
+            ok = True
+            return result
+        finally:
+            self._record(op, (time.perf_counter() - start) * 1000, ok)
+
+    async def _submit_write(self, func, args, kwargs):
+        """Queue one mutation and wait until its batch is committed"""
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((func, args, kwargs, future))
+        return await future
+
+    async def _drain_writes(self):
+        """Single consumer: apply queued mutations, committing each batch once"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < MAX_WRITE_BATCH and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            try:
+                outcomes = await loop.run_in_executor(self._writer, self._apply_writes, batch)
+            except Exception as e:
+                # The commit itself failed, so none of the batch was applied
+                outcomes = [(False, e)] * len(batch)
+            for (_, _, _, future), (ok, value) in zip(batch, outcomes):
+                if future.cancelled():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            for _ in batch:
+                self._write_queue.task_done()
+
+    def _apply_writes(self, batch):
+        """Run queued writes as one unit of work, each in its own savepoint"""
+        outcomes = []
+        with self.library.unit_of_work():
+            for func, args, kwargs, _ in batch:
+                try:
+                    with self.db.transaction():
+                        outcomes.append((True, func(*args, **kwargs)))
+                except Exception as e:
+                    outcomes.append((False, e))
+        return outcomes
+
+    def _record(self, op, elapsed_ms, ok):
+        with self._lock:
+            histogram = self._histograms.get(op)
+            if histogram is None:
+                histogram = self._histograms[op] = LatencyHistogram()
+            histogram.record(elapsed_ms, ok)
+
+    def stats(self):
+        """Latency histograms per operation plus queue and pool state"""
+        with self._lock:
+            latency = {op: h.as_dict() for op, h in sorted(self._histograms.items())}
+        return {
+            'latency': latency,
+            'write_queue_depth': self._write_queue.qsize() if self._write_queue else 0,
+            'read_workers': self.read_workers,
+            'pool': self.db.pool_stats(),
+            'queries': self.db.query_stats(10),
+            'report_staleness_seconds': self.managers['report'].staleness(),
+        }
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self.handle_line(line)
+                writer.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_line(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ServiceError('Request must be a JSON object')
+            request_id = request.get('id')
+            result = await self.dispatch(request.get('op', ''), tuple(request.get('args') or ()),
+                                         request.get('kwargs') or {})
+            return {'id': request_id, 'ok': True, 'result': result}
+        except Exception as e:
+            return {'id': request_id, 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Start listening; returns the bound (host, port)"""
+        self._write_queue = asyncio.Queue(self.write_queue_size)
+        self._writer_task = asyncio.create_task(self._drain_writes())
+        self._server = await asyncio.start_server(self.handle_client, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        address = await self.start(host, port)
+        print(f"Library service listening on {address[0]}:{address[1]}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._writer_task is not None:
+            await self._write_queue.join()
+            self._writer_task.cancel()
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self.library.close()
+
+
+class ServiceClient:
+    """Minimal blocking client for desk scripts"""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=30.0):
+        self._sock = socket.create_connection((host, port), timeout)
+        self._file = self._sock.makefile('rwb')
+        self._next_id = 0
+
+    def call(self, op, *args, **kwargs):
+        self._next_id += 1
+        request = {'id': self._next_id, 'op': op, 'args': args, 'kwargs': kwargs}
+        self._file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if not response['ok']:
+            raise ServiceError(response['error'])
+        return response['result']
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local library circulation service')
+    parser.add_argument('--db', default='library.db', help='database file (default: library.db)')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--read-workers', type=int, default=DEFAULT_READ_WORKERS)
+    args = parser.parse_args(argv)
+
+    service = LibraryService(args.db, args.read_workers)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# settings.py
+"""In-process cache of the ``settings`` table.
+
+The whole table is loaded once and served from memory. A revision counter
+(bumped by triggers on ``settings``) is polled at most every
+``check_interval`` seconds, so changes made by other processes are picked
+up without re-reading every value on every lookup.
+"""
+import os
+import threading
+import time
+
+# Known settings and how to parse them; anything else is returned as text
+SETTING_TYPES = {
+    'loan_period_days': int,
+    'max_books_per_member': int,
+    'fine_per_day': float,
+    'grace_period_days': int,
+    'max_fine_amount': float,
+    'allow_renewal': bool,
+    'renewal_days': int,
+}
+
+DEFAULT_CHECK_INTERVAL = 1.0
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _parse(name, value):
+    kind = SETTING_TYPES.get(name, str)
+    if kind is bool:
+        return str(value).strip().lower() in ('true', '1', 'yes', 'on')
+    return kind(value)
+
+
+class SettingsCache:
+    def __init__(self, db, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.db = db
+        self.check_interval = check_interval
+        self._values = None
+        self._revision = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _current_revision(self):
+        row = self.db.fetch_one('SELECT revision FROM settings_revision WHERE id = 1')
+        return row[0] if row else None
+
+    def _load(self):
+        revision = self._current_revision()
+        rows = self.db.fetch_all('SELECT setting_name, setting_value FROM settings')
+        self._values = {name: _parse(name, value) for name, value in rows}
+        self._revision = revision
+        self._checked_at = time.monotonic()
+        self.loads += 1
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if self._values is None:
+                self._load()
+                return
+            now = time.monotonic()
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            if self._current_revision() != self._revision:
+                self._load()
+
+    def get(self, name, default=None):
+        """Get a typed setting value"""
+        self._ensure_fresh()
+        return self._values.get(name, default)
+
+    def all(self):
+        """Get a copy of every setting"""
+        self._ensure_fresh()
+        return dict(self._values)
+
+    def set(self, name, value):
+        """Write a setting and invalidate every cache on this database file"""
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        success = self.db.execute_query('''
+            INSERT INTO settings (setting_name, setting_value) VALUES (?, ?)
+            ON CONFLICT (setting_name) DO UPDATE SET setting_value = excluded.setting_value
+        ''', (name, str(value)))
+        if success:
+            invalidate(self.db)
+        return success
+
+    def invalidate(self):
+        """Drop cached values; the next lookup reloads the table"""
+        with self._lock:
+            self._values = None
+
+
+def _cache_key(db):
+    return os.path.abspath(db.db_name) if db.db_name != ':memory:' else id(db)
+
+
+def get_settings(db, check_interval=DEFAULT_CHECK_INTERVAL):
+    """Get the shared settings cache for ``db``'s database file"""
+    key = _cache_key(db)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = SettingsCache(db, check_interval)
+        return cache
+
+
+def invalidate(db=None):
+    """Invalidate the settings cache for ``db`` (or every cache)"""
+    with _caches_lock:
+        caches = list(_caches.values()) if db is None else [_caches.get(_cache_key(db))]
+    for cache in caches:
+        if cache is not None:
+            cache.invalidate()
@@ -0,0 +1,169 @@
+# test_service.py
+"""LibraryService over TCP against a temporary database file."""
+import asyncio
+import threading
+
+import pytest
+
+from repository import Library
+from service import LATENCY_BUCKETS_MS, LibraryService, ServiceClient, ServiceError
+
+COPIES = 3
+BORROWERS = 10
+
+
+@pytest.fixture
+def service(tmp_path):
+    """A running service on an ephemeral port; yields (service, host, port)"""
+    svc = LibraryService(str(tmp_path / 'library.db'))
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    address = []
+
+    def run():
+        asyncio.set_event_loop(loop)
+        address.extend(loop.run_until_complete(svc.start('127.0.0.1', 0)))
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(10)
+    yield svc, address[0], address[1]
+    asyncio.run_coroutine_threadsafe(svc.stop(), loop).result(30)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    loop.close()
+
+
+@pytest.fixture
+def client(service):
+    _, host, port = service
+    c = ServiceClient(host, port)
+    yield c
+    c.close()
+
+
+def _call_concurrently(host, port, calls):
+    """Run each (op, args) from its own client connection at the same moment"""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def worker(i, op, args):
+        c = ServiceClient(host, port)
+        try:
+            barrier.wait()
+            try:
+                results[i] = c.call(op, *args)
+            except ServiceError as e:
+                results[i] = e
+        finally:
+            c.close()
+
+    threads = [threading.Thread(target=worker, args=(i, op, args))
+               for i, (op, args) in enumerate(calls)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    return results
+
+
+def test_concurrent_issues_keep_copies_and_counters_consistent(service, client):
+    _, host, port = service
+    assert client.call('book.add_book', 'Dune', 'Frank Herbert', '9780441013593', 'Fiction', COPIES)
+    book_id = client.call('book.search_books', '9780441013593', 'isbn')[0][0]
+    for i in range(BORROWERS):
+        assert client.call('member.add_member', f'Reader {i}', f'reader{i}@example.org')
+    member_ids = [row[0] for row in client.call('member.get_all_members')]
+
+    results = _call_concurrently(
+        host, port, [('transaction.issue_book', (book_id, member_id)) for member_id in member_ids])
+
+    assert results.count(True) == COPIES
+    assert results.count(False) == BORROWERS - COPIES
+    book = client.call('book.get_book_by_id', book_id)
+    assert book[6] == 0
+    active = client.call('transaction.get_active_transactions')
+    assert len(active) == COPIES
+    members = client.call('member.get_all_members')
+    assert sum(row[6] for row in members) == COPIES
+    # Trigger-maintained counters agree with the base tables
+    assert client.call('report.reconcile_counters') == {}
+    stats = dict(client.call('report.get_library_statistics'))
+    assert stats['Available Copies'] == 0
+    assert stats['Active Loans'] == COPIES
+    assert client.call('book.search_available', 'dune') == []
+
+
+@pytest.mark.parametrize('op', [
+    'transaction.accrue_fines',   # public, but not exposed
+    'book._has_fts',
+    'book.db',
+    'database.close',
+    'service.stop',
+    'nonsense',
+])
+def test_rejects_operations_outside_the_whitelist(client, op):
+    with pytest.raises(ServiceError, match='Unknown operation'):
+        client.call(op)
+
+
+def test_write_errors_reach_the_caller(service, client):
+    _, host, port = service
+    with pytest.raises(ServiceError, match='TypeError'):
+        client.call('book.update_copies', 1)
+    # A failing write batched with good ones only fails itself
+    results = _call_concurrently(host, port, [
+        ('member.add_member', ('Ada', 'ada@example.org')),
+        ('book.update_copies', (1,)),
+        ('member.add_member', ('Grace', 'grace@example.org')),
+    ])
+    assert results[0] is True and results[2] is True
+    assert isinstance(results[1], ServiceError) and 'TypeError' in str(results[1])
+    assert len(client.call('member.get_all_members')) == 2
+
+
+def test_stats_shape(client):
+    client.call('book.count_books')
+    client.call('member.add_member', 'Ada', 'ada@example.org')
+    with pytest.raises(ServiceError):
+        client.call('book.update_copies')
+
+    stats = client.call('service.stats')
+
+    assert set(stats) == {'latency', 'write_queue_depth', 'read_workers', 'pool', 'queries',
+                          'report_staleness_seconds'}
+    assert stats['write_queue_depth'] == 0
+    assert stats['read_workers'] >= 1
+    assert {'size', 'open', 'in_use', 'acquisitions'} <= set(stats['pool'])
+    for op in ('book.count_books', 'member.add_member', 'book.update_copies'):
+        histogram = stats['latency'][op]
+        assert set(histogram) == {'count', 'errors', 'mean_ms', 'max_ms', 'buckets'}
+        assert len(histogram['buckets']) == len(LATENCY_BUCKETS_MS)
+        assert sum(histogram['buckets'].values()) == histogram['count'] == 1
+    assert stats['latency']['book.update_copies']['errors'] == 1
+    assert stats['latency']['book.count_books']['errors'] == 0
+    assert stats['queries'] and {'normalized', 'calls', 'total_ms'} <= set(stats['queries'][0])
+
+
+def test_activity_reports_see_writes_committed_through_the_service(tmp_path, service, client):
+    assert client.call('book.add_book', 'Dune', 'Frank Herbert', '9780441013593', 'Fiction', COPIES)
+    assert client.call('member.add_member', 'Ada', 'ada@example.org')
+    assert client.call('member.add_member', 'Grace', 'grace@example.org')
+    assert client.call('transaction.issue_book', 1, 1)
+    assert client.call('transaction.issue_book', 1, 2)
+    transaction_id = client.call('transaction.get_active_transactions')[0][0]
+    assert client.call('transaction.return_book', transaction_id)
+
+    monthly = client.call('report.get_monthly_activity', 1)
+    daily = client.call('report.get_activity', None, None, 'day')
+
+    assert len(monthly) == 1 and monthly[0][1:3] == [2, 1]
+    assert len(daily) == 1 and daily[0][1:4] == [2, 1, 1]
+    direct = Library(db_name=str(tmp_path / 'library.db'))
+    try:
+        assert monthly == [list(row) for row in direct.report.get_monthly_activity(1)]
+        assert daily == [list(row) for row in direct.report.get_activity(granularity='day')]
+    finally:
+        direct.close()
@@ -1,127 +1,209 @@
 # transaction.py
-from database import Database
+import sqlite3
+import time
+from catalog_index import get_catalog_index
+from database import Database, DEFAULT_FETCH_SIZE
+from instrumentation import logger
+from settings import get_settings
 from datetime import datetime, timedelta
 
+# SQLite 默认最多 999 个绑定参数
+BATCH_SIZE = 500
+
+# 按到期日计算的逾期罚款（宽限期、日罚金与上限），参数 :grace, :rate, :cap
+OVERDUE_FINE_SQL = '''
+    MIN(MAX((unixepoch() - {t}due_date) / 86400 - :grace, 0) * :rate, :cap)'''
+
+# 应计罚款的集合表达式，与 calculate_fine 的逐行规则一致：已归还取结算金额，
+# 未归还取已计提金额与按到期日重算金额中的较大者
+ACCRUED_FINE_SQL = '''
+    COALESCE(CASE
+        WHEN {t}return_date IS NOT NULL THEN {t}fine_amount
+        ELSE MAX(COALESCE({t}fine_amount, 0.0), ''' + OVERDUE_FINE_SQL + ''')
+    END, 0.0)'''
+
+
+def accrued_fine_sql(alias=''):
+    """返回应计罚款 SQL 表达式（参数 :grace, :rate, :cap）"""
+    return ACCRUED_FINE_SQL.format(t=f'{alias}.' if alias else '')
+
+
+def fine_parameters(settings):
+    """从设置缓存中取出罚款规则"""
+    return {
+        'grace': settings.get('grace_period_days', 0),
+        'rate': settings.get('fine_per_day', 0.0),
+        'cap': settings.get('max_fine_amount', 0.0),
+    }
+
+class CirculationError(Exception):
+    """借还书规则校验失败"""
+
 class Transaction:
-    def __init__(self):
-        self.db = Database()
-        self.db.get_connection()
+    def __init__(self, db=None):
+        self.db = db or Database()
+        self.db.get_pool()
+        self.settings = get_settings(self.db)
+        # 借还时同步更新内存目录索引的可借数量
+        self.catalog = get_catalog_index(self.db)
     
-    def issue_book(self, book_id, member_id, loan_period_days=14):
+    def issue_book(self, book_id, member_id, loan_period_days=None):
         """借出书籍"""
-        # 检查书籍是否可用
-        book_query = '''
-            SELECT available_copies, title FROM books WHERE book_id = ?
-        '''
-        book = self.db.fetch_one(book_query, (book_id,))
-        
-        if not book or book[0] <= 0:
+        try:
+            with self.catalog.transaction(self.db) as (conn, changes):
+                self._issue(conn, book_id, member_id, loan_period_days, changes)
+            return True
+        except (CirculationError, sqlite3.Error):
+            # 语句错误已记录到 query_errors() 和 library.db 日志
             return False
-        
+        except Exception:
+            logger.exception('Error issuing book')
+            return False
+    
+    def issue_many(self, member_id, book_ids, loan_period_days=None):
+        """批量借出（一次提交），返回每本书的处理结果"""
+        return self._run_batch(
+            [{'book_id': book_id, 'member_id': member_id} for book_id in book_ids],
+            lambda conn, item, changes: self._issue(conn, item['book_id'], member_id, loan_period_days, changes),
+            'transaction_id')
+    
+    def _issue(self, conn, book_id, member_id, loan_period_days=None, changes=None):
+        """在当前事务中借出一本书，失败时抛出 CirculationError；changes 记录目录索引的变动"""
         # 检查会员状态
-        member_query = '''
-            SELECT status FROM members WHERE member_id = ?
-        '''
-        member = self.db.fetch_one(member_query, (member_id,))
+        member = conn.execute(
+            'SELECT status FROM members WHERE member_id = ?', (member_id,)).fetchone()
         
         if not member or member[0] != 'Active':
-            return False
+            raise CirculationError('Member not found or not active')
         
         # 检查会员借书数量限制
-        setting_query = '''
-            SELECT setting_value FROM settings WHERE setting_name = 'max_books_per_member'
-        '''
-        max_books = int(self.db.fetch_one(setting_query)[0])
+        max_books = self.settings.get('max_books_per_member', 5)
         
         current_loans_query = '''
             SELECT COUNT(*) FROM transactions 
             WHERE member_id = ? AND return_date IS NULL
         '''
-        current_loans = self.db.fetch_one(current_loans_query, (member_id,))[0]
+        current_loans = conn.execute(current_loans_query, (member_id,)).fetchone()[0]
         
         if current_loans >= max_books:
-            return False
+            raise CirculationError('Loan limit reached')
+        
+        # 条件扣减可用副本，防止并发超借
+        update_book_query = '''
+            UPDATE books
+            SET available_copies = available_copies - 1
+            WHERE book_id = ? AND available_copies > 0
+        '''
+        if conn.execute(update_book_query, (book_id,)).rowcount == 0:
+            raise CirculationError('Book not found or not available')
         
         # 计算到期日期
+        if loan_period_days is None:
+            loan_period_days = self.settings.get('loan_period_days', 14)
         issue_date = datetime.now()
         due_date = issue_date + timedelta(days=loan_period_days)
         
-        # 开始事务
+        # 插入交易记录
+        transaction_query = '''
+            INSERT INTO transactions (book_id, member_id, issue_date, due_date)
+            VALUES (?, ?, ?, ?)
+        '''
+        transaction_id = conn.execute(transaction_query,
+            (book_id, member_id, issue_date, due_date)).lastrowid
+        
+        # 更新会员借书数量
+        update_member_query = '''
+            UPDATE members
+            SET total_books_borrowed = total_books_borrowed + 1
+            WHERE member_id = ?
+        '''
+        conn.execute(update_member_query, (member_id,))
+        if changes is not None:
+            changes.adjust(book_id, -1)
+        return transaction_id
+    
+    def return_book(self, transaction_id):
+        """归还书籍"""
         try:
-            # 插入交易记录
-            transaction_query = '''
-                INSERT INTO transactions (book_id, member_id, issue_date, due_date)
-                VALUES (?, ?, ?, ?)
-            '''
-            self.db.execute_query(transaction_query, 
-                (book_id, member_id, issue_date, due_date))
-            
-            # 更新书籍可用副本
-            update_book_query = '''
-                UPDATE books
-                SET available_copies = available_copies - 1
-                WHERE book_id = ?
-            '''
-            self.db.execute_query(update_book_query, (book_id,))
-            
-            # 更新会员借书数量
-            update_member_query = '''
-                UPDATE members
-                SET total_books_borrowed = total_books_borrowed + 1
-                WHERE member_id = ?
-            '''
-            self.db.execute_query(update_member_query, (member_id,))
-            
+            with self.catalog.transaction(self.db) as (conn, changes):
+                self._return(conn, transaction_id, changes)
             return True
-        except Exception as e:
-            print(f"Error issuing book: {e}")
+        except (CirculationError, sqlite3.Error):
+            return False
+        except Exception:
+            logger.exception('Error returning book')
             return False
     
-    def return_book(self, transaction_id):
-        """归还书籍"""
-        # 获取交易信息
-        query = '''
-            SELECT book_id, member_id, due_date FROM transactions
-            WHERE transaction_id = ? AND return_date IS NULL
+    def return_many(self, transaction_ids):
+        """批量归还（一次提交），返回每笔借阅的处理结果"""
+        return self._run_batch(
+            [{'transaction_id': transaction_id} for transaction_id in transaction_ids],
+            lambda conn, item, changes: self._return(conn, item['transaction_id'], changes),
+            'fine')
+    
+    def _return(self, conn, transaction_id, changes=None):
+        """在当前事务中归还一本书，返回罚款金额；changes 记录目录索引的变动"""
+        # 计算罚款（与借阅记录同一连接读取）
+        query = f'''
+            SELECT book_id, {accrued_fine_sql()} FROM transactions
+            WHERE transaction_id = :id AND return_date IS NULL
         '''
-        transaction = self.db.fetch_one(query, (transaction_id,))
+        params = fine_parameters(self.settings)
+        params['id'] = transaction_id
+        transaction = conn.execute(query, params).fetchone()
         
         if not transaction:
-            return False
+            raise CirculationError('Loan not found or already returned')
         
-        book_id, member_id, due_date = transaction
+        book_id, fine = transaction
         return_date = datetime.now()
         
-        # 计算罚款
-        fine = self.calculate_fine(transaction_id)
+        # 更新交易记录（条件更新，防止重复归还）
+        update_transaction_query = '''
+            UPDATE transactions
+            SET return_date = ?, fine_amount = ?
+            WHERE transaction_id = ? AND return_date IS NULL
+        '''
+        if conn.execute(update_transaction_query,
+                        (return_date, fine, transaction_id)).rowcount == 0:
+            raise CirculationError('Loan not found or already returned')
         
+        # 更新书籍可用副本
+        update_book_query = '''
+            UPDATE books
+            SET available_copies = available_copies + 1
+            WHERE book_id = ?
+        '''
+        conn.execute(update_book_query, (book_id,))
+        if changes is not None:
+            changes.adjust(book_id, 1)
+        return fine
+    
+    def _run_batch(self, items, operation, result_key):
+        """在一个事务中逐项执行，每项用 SAVEPOINT 隔离失败"""
+        results = []
         try:
-            # 更新交易记录
-            update_transaction_query = '''
-                UPDATE transactions
-                SET return_date = ?, fine_amount = ?
-                WHERE transaction_id = ?
-            '''
-            self.db.execute_query(update_transaction_query, 
-                (return_date, fine, transaction_id))
-            
-            # 更新书籍可用副本
-            update_book_query = '''
-                UPDATE books
-                SET available_copies = available_copies + 1
-                WHERE book_id = ?
-            '''
-            self.db.execute_query(update_book_query, (book_id,))
-            
-            return True
+            with self.catalog.transaction(self.db) as (conn, changes):
+                for item in items:
+                    conn.execute('SAVEPOINT batch_item')
+                    try:
+                        value = operation(conn, item, changes)
+                        conn.execute('RELEASE SAVEPOINT batch_item')
+                        results.append(dict(item, success=True, error=None, **{result_key: value}))
+                    except (CirculationError, sqlite3.Error) as e:
+                        conn.execute('ROLLBACK TO SAVEPOINT batch_item')
+                        conn.execute('RELEASE SAVEPOINT batch_item')
+                        results.append(dict(item, success=False, error=str(e), **{result_key: None}))
         except Exception as e:
-            print(f"Error returning book: {e}")
-            return False
+            if not isinstance(e, sqlite3.Error):
+                logger.exception('Error processing batch')
+            return [dict(item, success=False, error=str(e), **{result_key: None}) for item in items]
+        return results
     
     def calculate_fine(self, transaction_id):
         """计算罚款"""
         query = '''
-            SELECT due_date, fine_amount FROM transactions
+            SELECT due_date, fine_amount, return_date FROM transactions
             WHERE transaction_id = ?
         '''
         transaction = self.db.fetch_one(query, (transaction_id,))
@@ -129,61 +211,129 @@ class Transaction:
         if not transaction:
             return 0.0
         
-        due_date_str, existing_fine = transaction
+        due_date, existing_fine, returned = transaction
+        existing_fine = existing_fine or 0.0
         
-        if existing_fine > 0:
+        # 已归还：罚款已在归还时结算
+        if returned:
             return existing_fine
         
-        # 如果已经有罚款或已归还，返回0
-        check_query = '''
-            SELECT return_date FROM transactions WHERE transaction_id = ?
-        '''
-        result = self.db.fetch_one(check_query, (transaction_id,))
-        
-        if result and result[0]:  # 已归还
-            return 0.0
-        
-        due_date = datetime.strptime(due_date_str, '%Y-%m-%d %H:%M:%S.%f')
-        current_date = datetime.now()
+        # 计算逾期天数（时间戳为 Unix 秒，与 SQL 表达式一致）
+        days_overdue = max(int(time.time()) - due_date, 0) // 86400
         
-        if current_date <= due_date:
-            return 0.0
+        # 罚款规则来自设置缓存
+        grace_period = self.settings.get('grace_period_days', 0)
+        fine_per_day = self.settings.get('fine_per_day', 0.0)
+        max_fine = self.settings.get('max_fine_amount', 0.0)
         
-        # 计算逾期天数
-        days_overdue = (current_date - due_date).days
+        # 计算罚款天数
+        fine_days = max(days_overdue - grace_period, 0)
+        fine = min(fine_days * fine_per_day, max_fine)
         
-        # 获取宽限期
-        setting_query = '''
-            SELECT setting_value FROM settings WHERE setting_name = 'grace_period_days'
-        '''
-        grace_period = int(self.db.fetch_one(setting_query)[0])
+        # 计提任务写入的金额不会被回退
+        return max(existing_fine, fine)
+    
+    def calculate_fines(self, transaction_ids=None):
+        """批量计算罚款，返回 {transaction_id: fine}；不传 ID 时计算所有未归还借阅"""
+        params = fine_parameters(self.settings)
+        if transaction_ids is None:
+            query = f'''
+                SELECT transaction_id, {accrued_fine_sql()}
+                FROM transactions
+                WHERE return_date IS NULL
+            '''
+            return dict(self.db.fetch_all(query, params))
         
-        if days_overdue <= grace_period:
-            return 0.0
+        fines = {}
+        ids = list(transaction_ids)
+        for i in range(0, len(ids), BATCH_SIZE):
+            chunk = ids[i:i + BATCH_SIZE]
+            placeholders = ', '.join(f':id{n}' for n in range(len(chunk)))
+            query = f'''
+                SELECT transaction_id, {accrued_fine_sql()}
+                FROM transactions
+                WHERE transaction_id IN ({placeholders})
+            '''
+            chunk_params = dict(params)
+            chunk_params.update({f'id{n}': tid for n, tid in enumerate(chunk)})
+            fines.update(self.db.fetch_all(query, chunk_params))
+        return fines
+    
+    def accrue_fines(self, chunk_size=BATCH_SIZE, pause=0.0):
+        """按到期日为所有逾期未还借阅计提罚款，分块提交（块间暂停 pause 秒让出写锁）；可重复执行，中断后从上次位置续跑"""
+        started = time.perf_counter()
+        params = fine_parameters(self.settings)
         
-        # 计算罚款天数
-        fine_days = days_overdue - grace_period
+        # 上次中断的运行从记录的位置继续，否则新开一次运行
+        run = self.db.fetch_one('''
+            SELECT run_id, last_transaction_id, loans_examined, loans_updated, chunks,
+                   COALESCE(duration_ms, 0)
+            FROM fine_accrual_runs
+            WHERE status = 'running'
+            ORDER BY run_id DESC LIMIT 1
+        ''')
+        if run:
+            run_id, last_id, examined, updated, chunks, previous_ms = run
+        else:
+            with self.db.transaction() as conn:
+                run_id = conn.execute('INSERT INTO fine_accrual_runs DEFAULT VALUES').lastrowid
+            last_id = examined = updated = chunks = 0
+            previous_ms = 0.0
         
-        # 获取每日罚款金额
-        setting_query = '''
-            SELECT setting_value FROM settings WHERE setting_name = 'fine_per_day'
+        chunk_query = '''
+            SELECT transaction_id FROM transactions
+            WHERE return_date IS NULL AND due_date < unixepoch()
+            AND transaction_id > ?
+            ORDER BY transaction_id
+            LIMIT ?
         '''
-        fine_per_day = float(self.db.fetch_one(setting_query)[0])
-        
-        # 获取最大罚款金额
-        setting_query = '''
-            SELECT setting_value FROM settings WHERE setting_name = 'max_fine_amount'
+        # 从到期日重算，而不是在已有金额上累加，所以重复执行结果不变
+        update_query = f'''
+            UPDATE transactions
+            SET fine_amount = {accrued_fine_sql()}
+            WHERE transaction_id > :after AND transaction_id <= :upto
+            AND return_date IS NULL AND due_date < unixepoch()
+            AND fine_amount IS NOT {accrued_fine_sql()}
         '''
-        max_fine = float(self.db.fetch_one(setting_query)[0])
+        while True:
+            ids = [row[0] for row in self.db.fetch_all(chunk_query, (last_id, chunk_size))]
+            if not ids:
+                break
+            with self.db.transaction() as conn:
+                updated += conn.execute(update_query, dict(params, after=last_id, upto=ids[-1])).rowcount
+                last_id = ids[-1]
+                examined += len(ids)
+                chunks += 1
+                conn.execute('''
+                    UPDATE fine_accrual_runs
+                    SET last_transaction_id = ?, loans_examined = ?, loans_updated = ?, chunks = ?,
+                        duration_ms = ?
+                    WHERE run_id = ?
+                ''', (last_id, examined, updated, chunks,
+                      previous_ms + (time.perf_counter() - started) * 1000, run_id))
+            if pause:
+                time.sleep(pause)
         
-        fine = fine_days * fine_per_day
-        return min(fine, max_fine)
+        duration_ms = previous_ms + (time.perf_counter() - started) * 1000
+        self.db.execute_query('''
+            UPDATE fine_accrual_runs
+            SET status = 'completed', finished_at = CURRENT_TIMESTAMP, duration_ms = ?
+            WHERE run_id = ?
+        ''', (duration_ms, run_id))
+        return {
+            'run_id': run_id,
+            'loans_examined': examined,
+            'loans_updated': updated,
+            'chunks': chunks,
+            'duration_ms': round(duration_ms, 3),
+        }
     
     def get_active_transactions(self):
         """获取活跃交易（未归还）"""
         query = '''
             SELECT t.transaction_id, b.title, m.name, 
-                   DATE(t.issue_date) as issue_date, DATE(t.due_date) as due_date
+                   date(t.issue_date, 'unixepoch', 'localtime') as issue_date,
+                   date(t.due_date, 'unixepoch', 'localtime') as due_date
             FROM transactions t
             JOIN books b ON t.book_id = b.book_id
             JOIN members m ON t.member_id = m.member_id
@@ -196,8 +346,9 @@ class Transaction:
         """获取交易历史"""
         query = '''
             SELECT t.transaction_id, b.title, m.name, 
-                   DATE(t.issue_date) as issue_date, DATE(t.due_date) as due_date,
-                   DATE(t.return_date) as return_date, t.fine_amount
+                   date(t.issue_date, 'unixepoch', 'localtime') as issue_date,
+                   date(t.due_date, 'unixepoch', 'localtime') as due_date,
+                   date(t.return_date, 'unixepoch', 'localtime') as return_date, t.fine_amount
             FROM transactions t
             JOIN books b ON t.book_id = b.book_id
             JOIN members m ON t.member_id = m.member_id
@@ -206,18 +357,36 @@ class Transaction:
         '''
         return self.db.fetch_all(query, (limit,))
     
-    def get_member_transactions(self, member_id):
-        """获取会员的交易记录"""
+    def iter_transactions(self, since_id=0, chunk_size=DEFAULT_FETCH_SIZE):
+        """按 transaction_id 顺序分块流式读取全部交易（用于导出，可从 since_id 之后续传）"""
         query = '''
-            SELECT t.transaction_id, b.title, 
-                   DATE(t.issue_date) as issue_date, DATE(t.due_date) as due_date,
-                   DATE(t.return_date) as return_date, t.fine_amount
+            SELECT t.transaction_id, t.book_id, b.title, t.member_id, m.name,
+                   datetime(t.issue_date, 'unixepoch', 'localtime'),
+                   datetime(t.due_date, 'unixepoch', 'localtime'),
+                   datetime(t.return_date, 'unixepoch', 'localtime'), t.fine_amount, t.fine_paid
             FROM transactions t
-            JOIN books b ON t.book_id = b.book_id
-            WHERE t.member_id = ?
-            ORDER BY t.issue_date DESC
+            LEFT JOIN books b ON t.book_id = b.book_id
+            LEFT JOIN members m ON t.member_id = m.member_id
+            WHERE t.transaction_id > ?
+            ORDER BY t.transaction_id
         '''
-        return self.db.fetch_all(query, (member_id,))
+        return self.db.iter_chunks(query, (since_id,), chunk_size)
+    
+    def get_member_transactions(self, member_id, include_archive=False):
+        """获取会员的交易记录（include_archive 为真时包含归档历史）"""
+        with self.db.get_connection() as conn:
+            source = self.db.history_source(conn, include_archive)
+            query = f'''
+                SELECT t.transaction_id, b.title, 
+                       date(t.issue_date, 'unixepoch', 'localtime') as issue_date,
+                       date(t.due_date, 'unixepoch', 'localtime') as due_date,
+                       date(t.return_date, 'unixepoch', 'localtime') as return_date, t.fine_amount
+                FROM {source} t
+                JOIN books b ON t.book_id = b.book_id
+                WHERE t.member_id = ?
+                ORDER BY t.issue_date DESC
+            '''
+            return self.db.fetch_all(query, (member_id,))
     
     def pay_fine(self, transaction_id, amount):
         """支付罚款"""